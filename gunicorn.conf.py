@@ -0,0 +1,12 @@
+# gunicorn picks this file up from the project directory (or pass it with -c)
+
+
+def post_worker_init(worker):
+    # runs in each worker once it has forked and loaded the app, with or without --preload:
+    # open the database connection and load templates/urls now rather than on the first voter's request
+    from django.conf import settings
+
+    if settings.WARM_WORKERS:
+        from votingapp.warmup import warm_process
+
+        warm_process()
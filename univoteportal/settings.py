@@ -2,6 +2,7 @@
 # IMPORTS
 # ======================================================================
 import os
+import sys
 from pathlib import Path
 from decouple import config
 import dj_database_url
@@ -45,12 +46,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    # Third-party apps
-    'storages',   # For S3
     # Your apps
     'votingapp',
 ]
 
+# django-storages (S3) is only needed in production. Even there boto3 isn't imported at
+# startup: STORAGES below names the backend as a string and Django only loads it the
+# first time a file is actually read or written.
+if IS_PRODUCTION:
+    INSTALLED_APPS.append('storages')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', # MUST be after SecurityMiddleware
@@ -58,6 +63,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'votingapp.replica.ReplicaMiddleware', # needs the session, so after the auth/session ones
+    'votingapp.profiling.ProfilingMiddleware', # needs request.user
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -85,13 +92,105 @@ WSGI_APPLICATION = 'univoteportal.wsgi.application'
 # ======================================================================
 # DATABASE
 # ======================================================================
+# keep each worker's connection open between requests instead of reconnecting every time
+CONN_MAX_AGE = config('CONN_MAX_AGE', default=60, cast=int)
+
 DATABASES = {
     'default': dj_database_url.config(
         default=config('DATABASE_URL'),
-        ssl_require=IS_PRODUCTION # Require SSL only in production
+        ssl_require=IS_PRODUCTION, # Require SSL only in production
+        conn_max_age=CONN_MAX_AGE,
+        conn_health_checks=True,
     )
 }
 
+# --- SQLITE PROFILE (small single-server deployments) ---
+# 'concurrent' (default): WAL journal so readers never wait for the writer, a busy timeout
+# instead of instant "database is locked" errors, BEGIN IMMEDIATE so a transaction takes
+# the write lock up front (select_for_update does nothing on sqlite), and every ballot
+# write in a worker goes through one writer thread (see votingapp/writer.py).
+# 'plain': Django's sqlite defaults.
+SQLITE_PROFILE = config('SQLITE_PROFILE', default='concurrent')
+USING_SQLITE = DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'
+
+if USING_SQLITE and SQLITE_PROFILE == 'concurrent':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+        'transaction_mode': 'IMMEDIATE',
+        # seconds a writer waits for the lock before giving up
+        'timeout': config('SQLITE_BUSY_TIMEOUT', default=20, cast=int),
+    })
+
+# not under `manage.py test`: each test runs inside one transaction on the test thread's
+# connection, which the writer thread's own connection can't see into
+TESTING = sys.argv[1:2] == ['test']
+BALLOT_WRITER_QUEUE = USING_SQLITE and SQLITE_PROFILE == 'concurrent' and not TESTING
+
+# --- OPTIONAL READ REPLICA ---
+# Results, dashboard and admin reads go to the replica when this is set
+# (see votingapp/replica.py). Locally you can point it at the same database as DATABASE_URL.
+REPLICA_DATABASE_URL = config('REPLICA_DATABASE_URL', default='')
+
+if REPLICA_DATABASE_URL:
+    DATABASES['replica'] = dj_database_url.parse(
+        REPLICA_DATABASE_URL,
+        ssl_require=IS_PRODUCTION,
+        conn_max_age=CONN_MAX_AGE,
+        conn_health_checks=True,
+    )
+    # tests don't get a separate replica database, they read the default one
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['votingapp.replica.ReplicaRouter']
+
+# the url names whose GET requests may read from the replica (the admin always may).
+# Not the ballot pages: their json is cached for good under the primary's content version
+REPLICA_READ_VIEWS = ['results_dashboard', 'election_results', 'election_turnout']
+
+# after a POST, that session reads from the primary for this many seconds (read-your-writes)
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
+
+# fall back to the primary when the replica is more than this many seconds behind
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=2, cast=float)
+REPLICA_LAG_CHECK_INTERVAL = 5
+
+
+# ======================================================================
+# CACHE
+# ======================================================================
+# One cache shared by every worker on every host, with an atomic add():
+#   - Redis when REDIS_URL is set (needs the `redis` package), the one to use in production
+#   - otherwise a table in the main database (created by migrate, see votingapp migration 0016).
+#     With the 'concurrent' sqlite profile its writes go through the ballot writer like the
+#     casts, so request threads never wait for the write lock (see votingapp/cache_backends.py)
+# Everything in here can be rebuilt (versions, eligibility masks, ballot json, tabulations...),
+# nothing that decides whether a vote counts lives only in the cache.
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': (
+                'votingapp.cache_backends.WriterDatabaseCache' if BALLOT_WRITER_QUEUE
+                else 'django.core.cache.backends.db.DatabaseCache'
+            ),
+            'LOCATION': 'votingapp_cache',
+            'OPTIONS': {
+                # one version key per voter plus a few per election, so this has to be well
+                # above the number of students or keys get culled in the middle of an election
+                'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=200000, cast=int),
+                'CULL_FREQUENCY': 10,
+            },
+        }
+    }
+
 
 # ======================================================================
 # AUTHENTICATION & PASSWORD VALIDATORS
@@ -173,6 +272,25 @@ else:
 # ======================================================================
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# How cast ballots are stored: 'rows' (one Vote per position) or 'packed' (one Ballot per voter)
+VOTE_STORAGE_MODE = config('VOTE_STORAGE_MODE', default='rows')
+
+# Each web worker opens its database connection and loads its templates and urls as it
+# boots, instead of on its first request (see votingapp/warmup.py)
+WARM_WORKERS = config('WARM_WORKERS', default=IS_PRODUCTION, cast=bool)
+
+# Sampling profiler (see votingapp/profiling.py). Staff can always profile one request with
+# ?_profile=1; on top of that, these url names get profiled at random at the given rate,
+# e.g. PROFILE_SAMPLE_RATES=ballot_view=0.01,cast_ballot_view=0.01
+PROFILE_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (
+        item.split('=') for item in config('PROFILE_SAMPLE_RATES', default='').split(',') if item.strip()
+    )
+}
+# seconds between stack samples of a profiled request
+PROFILE_INTERVAL = config('PROFILE_INTERVAL', default=0.005, cast=float)
+
 # Bootstrap Alert Classes
 MESSAGE_TAGS = {
     messages.DEBUG: 'alert-secondary',
@@ -185,8 +303,11 @@ MESSAGE_TAGS = {
 # ======================================================================
 # DEBUG CHECKS (Visible in Render Logs)
 # ======================================================================
-print("==================================================")
-print(f"--- [SETTINGS CHECK] IS_PRODUCTION: {IS_PRODUCTION}")
-print(f"--- [SETTINGS CHECK] DEBUG: {DEBUG}")
-print(f"--- [SETTINGS CHECK] Database Configured: {bool(DATABASES['default'])}")
-print("==================================================")
\ No newline at end of file
+# Off by default: settings are imported by every worker and every manage.py command.
+# Set SETTINGS_BANNER=True to see these in the logs again.
+if config('SETTINGS_BANNER', default=False, cast=bool):
+    print("==================================================")
+    print(f"--- [SETTINGS CHECK] IS_PRODUCTION: {IS_PRODUCTION}")
+    print(f"--- [SETTINGS CHECK] DEBUG: {DEBUG}")
+    print(f"--- [SETTINGS CHECK] Database Configured: {bool(DATABASES['default'])}")
+    print("==================================================")
\ No newline at end of file
@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'univoteportal.settings')
 
 application = get_wsgi_application()
+
+# each worker warms itself up after it has forked (see gunicorn.conf.py): doing it here would
+# open the database connections in the gunicorn master under --preload, shared by every worker
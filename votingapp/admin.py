@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import StudentProfile, Election, Position, Candidate, Vote, Party
+from django.db import transaction
+
+from .models import StudentProfile, Election, Position, Candidate, Vote, Party, Ballot, PollingStation, KioskBatch, RequestProfile
+from . import versions
 
 # --- 1. Student Profile Admin (The most important one) ---
 class StudentProfileAdmin(admin.ModelAdmin):
@@ -18,8 +21,8 @@ class StudentProfileAdmin(admin.ModelAdmin):
 # --- 2. Position Admin ---
 class PositionAdmin(admin.ModelAdmin):
     # Show the rules in the list view
-    list_display = ('name', 'election', 'limit_by_gender', 'limit_by_sponsorship', 'limit_by_session')
-    list_filter = ('election',)
+    list_display = ('name', 'election', 'voting_method', 'seats', 'limit_by_gender', 'limit_by_sponsorship', 'limit_by_session')
+    list_filter = ('election', 'voting_method')
 
 # --- 3. Candidate Admin ---
 class CandidateAdmin(admin.ModelAdmin):
@@ -27,12 +30,58 @@ class CandidateAdmin(admin.ModelAdmin):
     list_filter = ('position__election', 'party')
     search_fields = ('name',)
 
+# --- 4. Offline polling stations ---
+class PollingStationAdmin(admin.ModelAdmin):
+    # the secret has to be copied onto the kiosk device when it's set up
+    list_display = ('name', 'is_active')
+    readonly_fields = ('secret',)
+
+class KioskBatchAdmin(admin.ModelAdmin):
+    list_display = ('batch_id', 'station', 'election', 'received_at', 'ingested', 'already_voted', 'rejected')
+    list_filter = ('election', 'station')
+    readonly_fields = ('station', 'batch_id', 'election', 'received_at', 'ingested', 'already_voted', 'rejected')
+
+# --- 5. Request profiles (browsed at /profiles/) ---
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'url_name', 'path', 'status', 'trigger', 'duration_ms', 'sql_count')
+    list_filter = ('url_name', 'trigger')
+
+# --- 6. Votes deleted by hand ---
+# the vote tables have no delete signals (they'd slow down every cascade delete),
+# so the results are refreshed from here
+class VoteAdmin(admin.ModelAdmin):
+    election_field = 'position__election_id'
+
+    def _bump_tally(self, queryset):
+        election_ids = set(queryset.values_list(self.election_field, flat=True))
+
+        def bump():
+            for election_id in election_ids:
+                versions.bump_tally(election_id)
+
+        transaction.on_commit(bump)
+
+    def delete_model(self, request, obj):
+        self._bump_tally(type(obj).objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        self._bump_tally(queryset)
+        super().delete_queryset(request, queryset)
+
+class BallotAdmin(VoteAdmin):
+    election_field = 'election_id'
+
 # --- Register Models with Custom Classes ---
 admin.site.register(StudentProfile, StudentProfileAdmin)
 admin.site.register(Position, PositionAdmin)
 admin.site.register(Candidate, CandidateAdmin)
+admin.site.register(PollingStation, PollingStationAdmin)
+admin.site.register(KioskBatch, KioskBatchAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
 
 # --- Register Basic Models ---
 admin.site.register(Election)
-admin.site.register(Vote)
-admin.site.register(Party)
\ No newline at end of file
+admin.site.register(Vote, VoteAdmin)
+admin.site.register(Party)
+admin.site.register(Ballot, BallotAdmin)
\ No newline at end of file
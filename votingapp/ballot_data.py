@@ -0,0 +1,94 @@
+# ---------------- ballot data ----------------
+# The ballot of an election as plain JSON-able data, one copy per eligibility variant
+# (see eligibility.variant_key). voting_portal.html fetches this and draws the ballot
+# in the browser, so the server doesn't run the template engine over every candidate
+# for every voter. The rendered JSON is cached under the election's content version.
+
+import json
+
+from django.core.cache import cache
+
+from .eligibility import parse_variant, position_is_open_to
+from .images import variant_srcsets
+from . import replica, versions
+
+
+def _image(field_file):
+    # {'src', 'srcset_webp', 'srcset_jpg'} for an uploaded image, or None
+    if not field_file:
+        return None
+
+    srcsets = variant_srcsets(field_file)
+    if srcsets is None:
+        return {'src': field_file.url, 'srcset_webp': '', 'srcset_jpg': ''}
+    return {'src': srcsets['src'], 'srcset_webp': srcsets['webp'], 'srcset_jpg': srcsets['jpg']}
+
+
+def build_ballot(election, variant):
+    """
+    The ballot a student with this eligibility variant sees, as a dict.
+    Raises ValueError for a malformed variant.
+    """
+    attributes = parse_variant(variant)
+
+    positions = []
+    for position in election.positions.prefetch_related('candidates__party').order_by('pk'):
+        if not position_is_open_to(position, attributes):
+            continue
+
+        candidates = []
+        for candidate in position.candidates.all():
+            party = candidate.party
+            candidates.append({
+                'id': candidate.pk,
+                'name': candidate.name,
+                'photo': _image(candidate.candidate_photo),
+                'party': {'name': party.name, 'logo': _image(party.logo)} if party else None,
+                'symbol': None if party else _image(candidate.independent_symbol),
+            })
+
+        positions.append({
+            'id': position.pk,
+            'name': position.name,
+            'description': position.description,
+            'voting_method': position.voting_method,
+            'seats': position.seats,
+            'candidates': candidates,
+        })
+
+    return {
+        'election': {
+            'id': election.pk,
+            'name': election.name,
+            'description': election.description,
+        },
+        'variant': variant,
+        'positions': positions,
+    }
+
+
+def ballot_etag(election_id, variant):
+    # changes whenever the election's content version does, no need to build the ballot
+    try:
+        parse_variant(variant)
+    except ValueError:
+        return None
+    return f'{election_id}-{variant}-{versions.version_tag(versions.content_version(election_id))}'
+
+
+def ballot_json(election, variant):
+    """
+    Returns the ballot as compact json bytes, building it only when this version of it
+    isn't cached yet. Raises ValueError for a malformed variant.
+    """
+    tag = versions.version_tag(versions.content_version(election.pk))
+    key = f'votingapp:ballot:{election.pk}:{variant}:{tag}'
+
+    body = cache.get(key)
+    if body is None:
+        body = json.dumps(build_ballot(election, variant), separators=(',', ':')).encode()
+        # old versions just expire, nothing ever has to delete them
+        if not replica.used():
+            cache.set(key, body, 60 * 60 * 24)
+
+    return body
@@ -0,0 +1,227 @@
+# ---------------- vote storage ----------------
+# Two ways of storing a cast ballot, picked with settings.VOTE_STORAGE_MODE:
+#
+#   'rows'   -> one Vote row per position (the original way)
+#   'packed' -> one Ballot row per voter with every (position, candidate) pair packed
+#               into a small binary blob, so a 15 position ballot is 1 insert, not 15
+#
+# Counting goes through candidates_with_votes() which adds both storages together,
+# so results keep working whichever mode was on while people voted.
+#
+# Ranked (irv / stv) positions always store one RankedBallot per voter per position,
+# whatever the mode; those are counted by tabulation.py.
+
+import struct
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Ballot, Candidate, RankedBallot, Vote
+from . import replica, versions
+
+
+# one (position_id, candidate_id) pair, little-endian signed 64 bit ints
+PAIR = struct.Struct('<qq')
+
+
+def storage_mode():
+    return getattr(settings, 'VOTE_STORAGE_MODE', 'rows')
+
+
+def pack_choices(pairs):
+    # [(position_id, candidate_id), ...] -> bytes
+    flat = []
+    for position_id, candidate_id in pairs:
+        flat.append(int(position_id))
+        flat.append(int(candidate_id))
+    return struct.pack(f'<{len(flat)}q', *flat)
+
+
+def unpack_choices(blob):
+    # bytes -> iterator of (position_id, candidate_id)
+    return PAIR.iter_unpack(bytes(blob))
+
+
+def pack_ranking(candidate_ids):
+    # [candidate_id, ...] in preference order -> bytes
+    return struct.pack(f'<{len(candidate_ids)}q', *(int(c) for c in candidate_ids))
+
+
+def unpack_ranking(blob):
+    blob = bytes(blob)
+    return struct.unpack(f'<{len(blob) // 8}q', blob)
+
+
+def parse_submission(post):
+    """
+    Reads the ballot form into ([(position_id, candidate_id), ...], {position_id: [candidate ids best first]}).
+
+    Plain positions post "<position id>=<candidate id>" (several times for approval positions),
+    ranked positions post "rank-<position id>-<candidate id>=<rank>" and blank ranks are skipped.
+    Raises ValueError for anything malformed.
+    """
+    pairs = []
+    ranks = {}
+
+    for key in post:
+        # The keys for positions are their IDs (which are numbers)
+        if key.isdigit():
+            for value in post.getlist(key):
+                if not value.isdigit():
+                    raise ValueError("Invalid candidate on the ballot.")
+                pairs.append((int(key), int(value)))
+
+        elif key.startswith('rank-'):
+            value = post.get(key)
+            if not value:
+                continue
+            try:
+                _, position_id, candidate_id = key.split('-')
+                ranks.setdefault(int(position_id), []).append((int(value), int(candidate_id)))
+            except ValueError:
+                raise ValueError("Invalid ranking on the ballot.")
+
+    rankings = {}
+    for position_id, ranked in ranks.items():
+        ranked.sort()
+        numbers = [rank for rank, _ in ranked]
+        # ranks must be 1, 2, 3... with no gaps or repeats
+        if numbers != list(range(1, len(numbers) + 1)):
+            raise ValueError("Please number your choices 1, 2, 3... without skipping or repeating a number.")
+        rankings[position_id] = [candidate_id for _, candidate_id in ranked]
+
+    return pairs, rankings
+
+
+def _candidate_positions(election):
+    # {candidate_id: (position_id, voting_method)}, cached until the ballot changes
+    key = f'votingapp:candidates:{election.pk}:{versions.version_tag(versions.content_version(election.pk))}'
+    candidates = cache.get(key)
+    if candidates is None:
+        candidates = {
+            candidate_id: (position_id, method)
+            for candidate_id, position_id, method in Candidate.objects.filter(
+                position__election=election
+            ).values_list('pk', 'position_id', 'position__voting_method')
+        }
+        if not replica.used():
+            cache.set(key, candidates, 60 * 60 * 24)
+    return candidates
+
+
+def validate_ballot(election, pairs, rankings, candidates=None):
+    # every choice must be a candidate standing for that position, used the way the position allows.
+    # `candidates` is _candidate_positions(election), for callers checking many ballots at once
+    if candidates is None:
+        candidates = _candidate_positions(election)
+    seen = set()
+    per_position = {}
+
+    for position_id, candidate_id in pairs:
+        position_and_method = candidates.get(candidate_id)
+        if position_and_method is None or position_and_method[0] != position_id:
+            raise ValueError("Ballot contains a candidate that is not standing for that position.")
+        if position_and_method[1] in ('irv', 'stv'):
+            raise ValueError("That position has to be ranked.")
+        if (position_id, candidate_id) in seen:
+            raise ValueError("The same candidate was chosen twice.")
+        seen.add((position_id, candidate_id))
+        per_position[position_id] = per_position.get(position_id, 0) + 1
+
+        if position_and_method[1] == 'plurality' and per_position[position_id] > 1:
+            raise ValueError("Only one candidate can be chosen for that position.")
+
+    for position_id, ranking in rankings.items():
+        for candidate_id in ranking:
+            position_and_method = candidates.get(candidate_id)
+            if position_and_method is None or position_and_method[0] != position_id:
+                raise ValueError("Ballot contains a candidate that is not standing for that position.")
+            if position_and_method[1] not in ('irv', 'stv'):
+                raise ValueError("That position can't be ranked.")
+        if len(set(ranking)) != len(ranking):
+            raise ValueError("The same candidate was ranked twice.")
+
+
+def build_rows(election, pairs, rankings=None):
+    """
+    The unsaved rows for one voter's choices using the configured storage: `pairs` of
+    (position_id, candidate_id) for plurality/approval positions, and `rankings`
+    {position_id: [candidate ids best first]} for ranked ones.
+    Returns ([Vote...], [Ballot...], [RankedBallot...]). Nothing is validated here.
+    """
+    votes, packed, ranked = [], [], []
+
+    if pairs:
+        if storage_mode() == 'packed':
+            packed.append(Ballot(election=election, choices=pack_choices(pairs)))
+        else:
+            votes.extend(
+                Vote(position_id=position_id, candidate_id=candidate_id)
+                for position_id, candidate_id in pairs
+            )
+
+    for position_id, ranking in (rankings or {}).items():
+        ranked.append(RankedBallot(position_id=position_id, ranking=pack_ranking(ranking)))
+
+    return votes, packed, ranked
+
+
+def save_rows(votes, packed, ranked, batch_size=None):
+    # grab all the votes for all the candidates and stamp them into the database at once
+    if votes:
+        Vote.objects.bulk_create(votes, batch_size=batch_size)
+    if packed:
+        Ballot.objects.bulk_create(packed, batch_size=batch_size)
+    if ranked:
+        RankedBallot.objects.bulk_create(ranked, batch_size=batch_size)
+
+
+def record_ballot(election, pairs, rankings=None):
+    """
+    Validates and saves one voter's choices (see build_rows).
+    Raises ValueError for an invalid ballot. Must be called inside the cast transaction.
+    """
+    rankings = rankings or {}
+    validate_ballot(election, pairs, rankings)
+    save_rows(*build_rows(election, pairs, rankings))
+
+
+def packed_tally(election, chunk_size=2000):
+    # unpacks every packed ballot of the election in bulk and counts candidates.
+    # Cached until the election's tally changes, like the ranked tabulation
+    key = f'votingapp:packed-tally:{election.pk}:{versions.version_tag(versions.tally_version(election.pk))}'
+    tally = cache.get(key)
+    if tally is not None:
+        return tally
+
+    tally = Counter()
+    blobs = Ballot.objects.filter(election=election).values_list('choices', flat=True)
+    for blob in blobs.iterator(chunk_size=chunk_size):
+        tally.update(candidate_id for _, candidate_id in unpack_choices(blob))
+    if not replica.used():
+        cache.set(key, tally, 60 * 60 * 24)
+    return tally
+
+
+def candidates_with_votes(election):
+    """
+    The election's candidates with a `vote_count` attribute, ordered by position and
+    then most votes first. Same shape as the old Count('votes') annotation, with any
+    packed ballots added in.
+    """
+    candidates = list(
+        Candidate.objects.filter(position__election=election)
+        .annotate(vote_count=Count('votes'))
+        .order_by('position', '-vote_count')
+    )
+
+    tally = packed_tally(election)
+    if tally:
+        for candidate in candidates:
+            candidate.vote_count += tally.get(candidate.pk, 0)
+        # re-sort, python's sort is stable so ties keep their order
+        candidates.sort(key=lambda candidate: (candidate.position_id, -candidate.vote_count))
+
+    return candidates
@@ -0,0 +1,23 @@
+# ---------------- the cache on sqlite ----------------
+# With the 'concurrent' sqlite profile and no REDIS_URL the shared cache is a table in the
+# same sqlite file as the votes, where every transaction takes the write lock up front
+# (BEGIN IMMEDIATE). So its writes go through the ballot writer like casts do (see
+# writer.py): request threads only read it, which WAL never blocks.
+
+from django.core.cache.backends.db import DatabaseCache
+
+from . import writer
+
+
+class WriterDatabaseCache(DatabaseCache):
+    # DatabaseCache does all of its writing in these: _base_set for set/add/touch,
+    # _base_delete_many for delete/delete_many and the expired rows get() finds, and clear
+
+    def _base_set(self, *args, **kwargs):
+        return writer.run(super()._base_set, *args, **kwargs)
+
+    def _base_delete_many(self, keys):
+        return writer.run(super()._base_delete_many, keys)
+
+    def clear(self):
+        return writer.run(super().clear)
@@ -0,0 +1,205 @@
+# ---------------- eligibility engine ----------------
+# Works out how many students can vote for each position WITHOUT looping over
+# every (student, position) pair in python like ballot_view does for one student.
+#
+# The idea: every student profile gets a bit (its primary key is the bit number).
+# For every value of gender / sponsorship / session we build one big bitmask of the
+# students that have that value. A position's eligible set is then just the AND of
+# the masks for whatever limits it has, and the count is a popcount.
+# Python ints do the AND/popcount over 64-bit words in C, so this is effectively
+# a vectorised evaluation of all the rules at once.
+
+from itertools import product
+
+from django.core.cache import cache
+
+from .models import StudentProfile
+from . import participation, replica, versions
+
+
+# how long (seconds) we keep an election's computed masks around
+ELIGIBILITY_CACHE_TIMEOUT = 300
+
+# the student attribute each position limit is checked against
+RULE_FIELDS = (
+    ('limit_by_gender', 'gender'),
+    ('limit_by_sponsorship', 'sponsorship_type'),
+    ('limit_by_session', 'session_category'),
+)
+
+
+def variant_key(profile):
+    """
+    The profile's "eligibility variant": its gender, sponsorship and session joined
+    with dots ('-' when blank), e.g. 'Female.Government.Weekend'. Every student with the
+    same variant sees exactly the same ballot, so there are at most 27 of them.
+    """
+    return '.'.join(getattr(profile, field) or '-' for _, field in RULE_FIELDS)
+
+
+def parse_variant(key):
+    # 'Female.Government.Weekend' -> {'gender': 'Female', ...}; ValueError if it's not valid
+    values = key.split('.')
+    if len(values) != len(RULE_FIELDS):
+        raise ValueError(f"Bad eligibility variant: {key}")
+
+    attributes = {}
+    for (_, field), value in zip(RULE_FIELDS, values):
+        allowed = {choice for choice, _ in StudentProfile._meta.get_field(field).choices}
+        if value != '-' and value not in allowed:
+            raise ValueError(f"Bad eligibility variant: {key}")
+        attributes[field] = None if value == '-' else value
+    return attributes
+
+
+def all_variants():
+    # every possible variant key, blanks included
+    values = [
+        ['-'] + [choice for choice, _ in StudentProfile._meta.get_field(field).choices]
+        for _, field in RULE_FIELDS
+    ]
+    return ['.'.join(combination) for combination in product(*values)]
+
+
+def position_is_open_to(position, attributes):
+    # same rules as ballot_view, checked against a variant's attributes
+    return all(
+        not getattr(position, rule) or getattr(position, rule) == attributes[field]
+        for rule, field in RULE_FIELDS
+    )
+
+
+def _mask_from_ordinals(ordinals, size):
+    # sets bit `n` for every n in ordinals. Going through a bytearray keeps this
+    # O(students) instead of doing `mask |= 1 << n` which copies the int every time
+    buf = bytearray(size // 8 + 1)
+    for n in ordinals:
+        buf[n >> 3] |= 1 << (n & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def ordinals_from_mask(mask):
+    # the reverse of the above: turns a mask back into the list of set bit numbers
+    ordinals = []
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        if not byte:
+            continue
+        base = byte_index << 3
+        for bit in range(8):
+            if byte & (1 << bit):
+                ordinals.append(base + bit)
+    return ordinals
+
+
+class Roster:
+    """
+    The eligible student roster loaded ONCE as compact integer codes and bitmasks.
+
+    `everyone` is the mask of all students with is_eligible=True, and
+    `masks[field][value]` is the mask of those students having that value.
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        size = max((row[0] for row in rows), default=0)
+
+        self.everyone = _mask_from_ordinals((row[0] for row in rows), size)
+        self.masks = {}
+
+        for column, (_, field) in enumerate(RULE_FIELDS, start=1):
+            # integer-code each distinct value of this attribute first...
+            codes = {}
+            per_code = []
+            for row in rows:
+                value = row[column]
+                if value is None:
+                    continue
+                code = codes.setdefault(value, len(codes))
+                if code == len(per_code):
+                    per_code.append([])
+                per_code[code].append(row[0])
+
+            # ...then build one mask per code
+            self.masks[field] = {
+                value: _mask_from_ordinals(per_code[code], size)
+                for value, code in codes.items()
+            }
+
+    @classmethod
+    def load(cls):
+        # one query, four small columns, no model instances
+        return cls(
+            StudentProfile.objects.filter(is_eligible=True)
+            .values_list('pk', 'gender', 'sponsorship_type', 'session_category')
+            .iterator(chunk_size=5000)
+        )
+
+    def mask_for(self, position):
+        # start with everyone and knock out whoever fails each limit
+        mask = self.everyone
+        for rule, field in RULE_FIELDS:
+            limit = getattr(position, rule)
+            if limit:
+                mask &= self.masks[field].get(limit, 0)
+        return mask
+
+
+def _cache_key(election_id):
+    # any change to the student profiles gives a new key
+    return f'votingapp:eligibility:{election_id}:{versions.version_tag(versions.roster_version())}'
+
+
+def position_masks(election, refresh=False):
+    """
+    Returns {position_id: eligible mask} for every position in the election,
+    computing it from a fresh roster load only when it isn't cached already.
+    """
+    key = _cache_key(election.pk)
+    masks = None if refresh else cache.get(key)
+
+    if masks is None:
+        roster = Roster.load()
+        masks = {
+            position.pk: roster.mask_for(position)
+            for position in election.positions.all()
+        }
+        # (read from a replica that may be behind the roster version: not kept, see replica.py)
+        if not replica.used():
+            cache.set(key, masks, ELIGIBILITY_CACHE_TIMEOUT)
+
+    return masks
+
+
+def eligible_counts(election, refresh=False):
+    # {position_id: number of students allowed to vote for it}
+    return {
+        position_id: mask.bit_count()
+        for position_id, mask in position_masks(election, refresh).items()
+    }
+
+
+def voted_mask(election):
+    # the students who already voted in this election, straight off the participation bitmap
+    return participation.load(election).as_mask()
+
+
+def eligible_non_voter_ids(election, position_id=None, refresh=False):
+    """
+    Profile ids of students who can vote (for `position_id`, or for at least one
+    position when it's None) but haven't voted in this election yet.
+    """
+    masks = position_masks(election, refresh)
+
+    if position_id is not None:
+        mask = masks.get(position_id, 0)
+    else:
+        mask = 0
+        for position_mask in masks.values():
+            mask |= position_mask
+
+    return ordinals_from_mask(mask & ~voted_mask(election))
+
+
+def invalidate(election_id):
+    cache.delete(_cache_key(election_id))
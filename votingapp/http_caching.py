@@ -0,0 +1,121 @@
+# ---------------- conditional GET for pages ----------------
+# Pages get an ETag and Last-Modified built from the versions in versions.py.
+# When the browser already has the current page it sends the ETag back and gets a
+# "304 Not Modified" straight away: a few cache reads, no queries, no template rendering.
+
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from . import replica, versions
+
+
+def conditional_page(page_state):
+    """
+    Decorator for GET views. `page_state(request, *args, **kwargs)` returns
+    (list of things the page depends on, last modified unix time), or None when the
+    page can't be cached right now (it will then just render as usual).
+
+    Put it *under* the login/profile decorators so it only runs for allowed users.
+    """
+    def decorator(view_func):
+
+        def _state(request, *args, **kwargs):
+            # worked out once per request, both condition() callbacks use it
+            if not hasattr(request, '_page_state'):
+                request._page_state = None
+
+                # a pending flash message has to be shown, so never answer with a 304
+                if not len(get_messages(request)):
+                    state = page_state(request, *args, **kwargs)
+                    if state is not None:
+                        parts, last_modified = state
+                        # the page shows the username and carries the csrf token
+                        parts = [*parts, request.user.pk, request.META.get('CSRF_COOKIE')]
+                        etag = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+                        request._page_state = (etag, datetime.fromtimestamp(last_modified, tz=dt_timezone.utc))
+            return request._page_state
+
+        def _etag(request, *args, **kwargs):
+            state = _state(request, *args, **kwargs)
+            return state[0] if state else None
+
+        def _last_modified(request, *args, **kwargs):
+            state = _state(request, *args, **kwargs)
+            return state[1] if state else None
+
+        conditional_view = condition(etag_func=_etag, last_modified_func=_last_modified)(view_func)
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if replica.used() and response.status_code == 200:
+                # built from a replica that may be behind the versions in the etag: sent
+                # back, that etag would pin the stale page with 304s (see replica.py)
+                del response['ETag']
+                del response['Last-Modified']
+            if getattr(request, '_page_state', None):
+                # per-user pages: the browser may keep them but must check the etag every time
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return _wrapped_view
+
+    return decorator
+
+
+def open_election_ids(now):
+    return [
+        election_id
+        for election_id, start_time, end_time in versions.election_schedule()
+        if start_time <= now <= end_time
+    ]
+
+
+# --- the state of each cached page ---
+
+def election_list_state(request):
+    open_ids = open_election_ids(timezone.now())
+    voter = versions.voter_version(request.profile.pk)
+    elections = versions.elections_version()
+    contents = [versions.content_version(election_id) for election_id in open_ids]
+    return (
+        ['election_list', open_ids, elections, voter, contents],
+        max([elections, voter, *contents]),
+    )
+
+
+def ballot_state(request, election_id):
+    # closed (or missing) elections: let the view deal with it
+    if election_id not in open_election_ids(timezone.now()):
+        return None
+    # the plain server drawn version isn't worth caching
+    if request.GET:
+        return None
+    # the page has a form, and with no csrf cookie yet this response is about to set
+    # one, which would change the etag on the very next request anyway
+    if not request.META.get('CSRF_COOKIE'):
+        return None
+
+    content = versions.content_version(election_id)
+    voter = versions.voter_version(request.profile.pk)
+    # the shell shows different things for eligible/ineligible students and per variant
+    roster = versions.roster_version()
+    return (['ballot', election_id, content, voter, roster], max(content, voter, roster))
+
+
+def results_dashboard_state(request):
+    elections = versions.elections_version()
+    return (['results_dashboard', elections], elections)
+
+
+def election_results_state(request, election_id):
+    content = versions.content_version(election_id)
+    tally = versions.tally_version(election_id)
+    roster = versions.roster_version()
+    return (['election_results', election_id, content, tally, roster], max(content, tally, roster))
@@ -0,0 +1,83 @@
+# ---------------- idempotent casting ----------------
+# Every ballot form carries a random `ballot_token`. When the vote is counted the token is
+# saved as a CastToken row in the same transaction, so when a busy server makes students
+# double-click (or the browser resends the POST) the repeat finds the row and goes straight
+# to the thank you page with the original outcome.
+#
+# While the first copy is still being cast there is no row yet. To keep the repeat from
+# queueing up behind the first one's row lock it claims the token in the shared cache first:
+#
+#   claimed          -> first time we see this token, go ahead and cast
+#   already claimed  -> the first submission is still being processed; the student gets the
+#                       "your vote is being recorded" page straight away, which checks back
+#                       (see cast_status_view)
+#
+# The cache is only a shortcut: if two copies both get in (the entry expired, or the cache
+# is down) the profile lock and the already voted check in the cast still stop the second,
+# and its token row tells it that it was the same form. A failed cast removes its entry,
+# so the student can fix the ballot and send it again. Tokens belong to one user, so a
+# token can't be replayed from someone else's account.
+
+import re
+import uuid
+
+from django.core.cache import cache
+
+from .models import CastToken
+
+
+PENDING = 'pending'
+
+TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# only has to outlive the cast itself; after that the CastToken row answers
+CLAIM_TIMEOUT = 60 * 5
+
+
+def new_token():
+    return uuid.uuid4().hex
+
+
+def valid(token):
+    # a missing or malformed token (an old form) behaves as before tokens existed
+    return bool(token) and bool(TOKEN_RE.match(token))
+
+
+def _key(user_id, election_id, token):
+    return f'votingapp:cast:{user_id}:{election_id}:{token}'
+
+
+def was_cast(user_id, election_id, token):
+    # the form with this token has been counted
+    if not valid(token):
+        return False
+    return CastToken.objects.filter(user_id=user_id, election_id=election_id, token=token).exists()
+
+
+def record(user, election, token):
+    # called inside the cast transaction, so the token is saved if and only if the vote is
+    if valid(token):
+        CastToken.objects.create(user=user, election=election, token=token)
+
+
+def claim(user_id, election_id, token):
+    """
+    Marks the token as being cast. Returns True when this request owns it and should cast
+    (also for a missing or malformed token), False while another copy of the form holds it.
+    Never waits.
+    """
+    if not valid(token):
+        return True
+    return cache.add(_key(user_id, election_id, token), PENDING, CLAIM_TIMEOUT)
+
+
+def is_pending(user_id, election_id, token):
+    # another copy of the form is still being cast
+    return valid(token) and cache.get(_key(user_id, election_id, token)) == PENDING
+
+
+def release(user_id, election_id, token):
+    # the form was not counted (the cast failed, or they had voted with another form), so the
+    # token may be used again. Only for the request that claimed it
+    if valid(token):
+        cache.delete(_key(user_id, election_id, token))
@@ -0,0 +1,157 @@
+# ---------------- image variants ----------------
+# Candidate photos, party logos and independent symbols are uploaded at whatever size
+# people have on their phones. Serving those straight to a ballot with dozens of
+# candidates means megabytes per voter, so we make small WebP + JPEG copies at a few
+# fixed widths and let the browser pick one through srcset.
+#
+# Variants live next to the original in the default storage (S3 in production):
+#   candidate_photos/jane.png -> candidate_photos/variants/jane.png-160w.webp
+#
+# Pillow is only imported when an image actually gets resized: every web worker loads
+# this module at startup (signals, ballot rendering) but hardly any of them resize.
+
+import hashlib
+import posixpath
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .models import Candidate, ImageDerivative, Party
+from . import replica, versions
+
+
+# widths we generate (a bit more than the 80px / 150px the css shows, for retina screens)
+VARIANT_WIDTHS = (80, 160, 320)
+
+# (file extension, pillow format, save options)
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+# every (model, image field) pair that gets variants
+IMAGE_FIELDS = (
+    (Candidate, 'candidate_photo'),
+    (Candidate, 'independent_symbol'),
+    (Party, 'logo'),
+)
+
+PROCESSED_CACHE_KEY = 'votingapp:image-variants'
+
+
+def variant_name(source, width, extension):
+    # the whole file name, extension included, so jane.png and jane.jpg don't share variants
+    directory, filename = posixpath.split(source)
+    return posixpath.join(directory, 'variants', f'{filename}-{width}w.{extension}')
+
+
+def _flatten(image):
+    # jpeg has no transparency, so put transparent logos on a white background
+    if image.mode == 'RGBA':
+        from PIL import Image
+
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image
+
+
+def generate_variants(source, force=False):
+    """
+    Makes the resized copies of one stored image. Skips the work when the source
+    hasn't changed since last time (same sha256), unless force=True.
+    Returns True if variants were (re)generated.
+    """
+    with default_storage.open(source, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    existing = ImageDerivative.objects.filter(source=source).first()
+    if existing and existing.content_hash == content_hash and not force:
+        return False
+
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # never upscale: a small logo just gets one variant at its own width
+    widths = [width for width in VARIANT_WIDTHS if width < image.width] or [image.width]
+
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+
+        for extension, pillow_format, options in VARIANT_FORMATS:
+            out = BytesIO()
+            frame = resized if pillow_format == 'WEBP' else _flatten(resized)
+            frame.save(out, pillow_format, **options)
+
+            name = variant_name(source, width, extension)
+            # storage.save() would rename instead of overwriting, so clear the old one first
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(out.getvalue()))
+
+    ImageDerivative.objects.update_or_create(
+        source=source,
+        defaults={'content_hash': content_hash, 'widths': widths},
+    )
+    cache.delete(PROCESSED_CACHE_KEY)
+    # ballots that showed the original can now use the variants
+    versions.bump_content()
+    return True
+
+
+def processed_sources():
+    # {source name: [widths]} for every image with variants, one cache hit per request
+    processed = cache.get(PROCESSED_CACHE_KEY)
+    if processed is None:
+        processed = dict(ImageDerivative.objects.values_list('source', 'widths'))
+        if not replica.used():
+            cache.set(PROCESSED_CACHE_KEY, processed, None)
+    return processed
+
+
+def variant_srcsets(field_file):
+    """
+    For an ImageField value returns {'webp': srcset, 'jpg': srcset, 'src': smallest jpg url},
+    or None if no variants have been generated for it yet.
+    """
+    if not field_file:
+        return None
+
+    widths = processed_sources().get(field_file.name)
+    if not widths:
+        return None
+
+    srcsets = {}
+    for extension, _, _ in VARIANT_FORMATS:
+        srcsets[extension] = ', '.join(
+            f'{default_storage.url(variant_name(field_file.name, width, extension))} {width}w'
+            for width in widths
+        )
+    srcsets['src'] = default_storage.url(variant_name(field_file.name, widths[0], 'jpg'))
+    return srcsets
+
+
+def all_sources():
+    # every image name currently referenced by a candidate or party
+    sources = set()
+    for model, field in IMAGE_FIELDS:
+        sources.update(
+            model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''})
+            .values_list(field, flat=True)
+        )
+    return sorted(sources)
+
+
+def regenerate_in_worker(source, force):
+    # runs inside a process pool worker (see the regenerate_image_variants command)
+    try:
+        return source, generate_variants(source, force), None
+    except Exception as e:
+        return source, False, str(e)
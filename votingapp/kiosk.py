@@ -0,0 +1,215 @@
+# ---------------- offline polling stations ----------------
+# For campuses with bad connectivity: a kiosk device (PollingStation) downloads a signed
+# snapshot of the election while it's online, runs the vote offline, then hands back a
+# signed, compressed batch of ballots that staff upload (kiosk_upload_view).
+#
+# Everything is signed with the station's own secret using django.core.signing (which
+# also zlib-compresses the payload), so a batch can't be forged or edited on the way.
+#
+# A batch entry pairs a ballot with the student_id of whoever cast it. The pairing is
+# only used while ingesting, to drop ballots of students who already voted online (or in
+# another batch); it is never stored, so saved ballots are as anonymous as online ones.
+#
+# batch payload:
+#   {"batch_id": "...", "election_id": 1,
+#    "entries": [{"student_id": "S001", "choices": [[position_id, candidate_id], ...],
+#                 "rankings": {"position_id": [candidate ids best first]}}, ...]}
+
+import random
+
+from django.core import signing
+from django.db import IntegrityError, transaction
+
+from .ballot_data import build_ballot
+from .eligibility import RULE_FIELDS, eligible_non_voter_ids, parse_variant, position_is_open_to, variant_key
+from .models import KioskBatch, StudentProfile
+from . import ballots, participation, versions
+
+
+SNAPSHOT_SALT = 'votingapp.kiosk.snapshot'
+BATCH_SALT = 'votingapp.kiosk.batch'
+
+# rows per INSERT when saving a batch
+BULK_SIZE = 1000
+
+
+def build_snapshot(election, station, student_id_prefix=''):
+    """
+    Signed snapshot for a station: the ballot for every eligibility variant, and the
+    eligible students (optionally only those whose student_id starts with a prefix)
+    who haven't voted yet, each with their variant.
+    """
+    profiles = StudentProfile.objects.filter(pk__in=eligible_non_voter_ids(election))
+    if student_id_prefix:
+        profiles = profiles.filter(student_id__startswith=student_id_prefix)
+
+    roster = {}
+    for profile in profiles.only('student_id', *(field for _, field in RULE_FIELDS)).iterator():
+        roster[profile.student_id] = variant_key(profile)
+
+    payload = {
+        'station': station.name,
+        'election': {
+            'id': election.pk,
+            'name': election.name,
+            'start_time': election.start_time.isoformat(),
+            'end_time': election.end_time.isoformat(),
+        },
+        'content_version': versions.version_tag(versions.content_version(election.pk)),
+        'ballots': {variant: build_ballot(election, variant) for variant in set(roster.values())},
+        'roster': roster,
+    }
+    return signing.dumps(payload, key=station.secret, salt=SNAPSHOT_SALT, compress=True)
+
+
+def read_batch(station, token):
+    # checks the signature and unpacks a batch; ValueError if it isn't genuine
+    try:
+        return signing.loads(token, key=station.secret, salt=BATCH_SALT)
+    except signing.BadSignature:
+        raise ValueError(f"This batch was not signed by {station.name}.")
+
+
+def sign_batch(station, batch):
+    # what the kiosk device does before uploading (also handy for testing)
+    return signing.dumps(batch, key=station.secret, salt=BATCH_SALT, compress=True)
+
+
+def check_batch(batch):
+    """
+    A good signature only tells us which station sent the batch, so check it has the
+    shape described at the top before touching anything. ValueError if it doesn't.
+    Individual ballots with bad ids are still just rejected one by one while ingesting.
+    """
+    if not isinstance(batch, dict):
+        raise ValueError("The batch is not in the kiosk format.")
+    if not isinstance(batch.get('entries'), list):
+        raise ValueError("The batch has no list of entries.")
+
+    for number, entry in enumerate(batch['entries'], start=1):
+        if not isinstance(entry, dict) or not isinstance(entry.get('student_id'), (str, int)):
+            raise ValueError(f"Entry {number} is not a ballot with a student_id.")
+        choices = entry.get('choices') or []
+        rankings = entry.get('rankings') or {}
+        if not isinstance(choices, list) or not all(isinstance(pair, list) and len(pair) == 2 for pair in choices):
+            raise ValueError(f"Entry {number} has choices that aren't [position, candidate] pairs.")
+        if not isinstance(rankings, dict) or not all(isinstance(ranking, list) for ranking in rankings.values()):
+            raise ValueError(f"Entry {number} has rankings that aren't lists of candidates.")
+
+
+def ingest_batch(station, election, batch):
+    """
+    Saves an unpacked batch in one transaction and returns (KioskBatch, created) like
+    get_or_create. Uploading the same batch again just returns the first record.
+    """
+    check_batch(batch)
+    batch_id = str(batch.get('batch_id', ''))[:64]
+    if not batch_id:
+        raise ValueError("The batch has no batch_id.")
+    if batch.get('election_id') != election.pk:
+        raise ValueError("This batch is for a different election.")
+
+    existing = KioskBatch.objects.filter(station=station, batch_id=batch_id).first()
+    if existing:
+        return existing, False
+
+    try:
+        return _ingest(station, election, batch_id, batch['entries']), True
+    except IntegrityError:
+        # the same file uploaded twice at once: the other upload got its record in first
+        existing = KioskBatch.objects.filter(station=station, batch_id=batch_id).first()
+        if existing is None:
+            raise
+        return existing, False
+
+
+def _ingest(station, election, batch_id, entries):
+    through = StudentProfile.voted_in_elections.through
+
+    with transaction.atomic():
+        # the batch's record goes in first: a second upload of the same batch running at
+        # the same time waits on its unique constraint and then fails, instead of counting twice
+        record = KioskBatch.objects.create(station=station, batch_id=batch_id, election=election)
+
+        # 1. everyone in the batch, locked the same way cast_ballot_view locks a voter,
+        #    so an online vote can't slip in between our check and our insert
+        student_ids = {str(entry.get('student_id')) for entry in entries}
+        profiles = {
+            profile.student_id: (profile.pk, variant_key(profile))
+            for profile in StudentProfile.objects.select_for_update()
+            .filter(student_id__in=student_ids, is_eligible=True)
+            .only('student_id', *(field for _, field in RULE_FIELDS))
+        }
+        already = set(
+            through.objects.filter(
+                election_id=election.pk,
+                studentprofile_id__in=[pk for pk, _ in profiles.values()],
+            ).values_list('studentprofile_id', flat=True)
+        )
+
+        # which positions each variant may vote for (at most 27 variants)
+        positions = list(election.positions.all())
+        open_positions = {}
+        for _, variant in profiles.values():
+            if variant not in open_positions:
+                attributes = parse_variant(variant)
+                open_positions[variant] = {
+                    position.pk for position in positions if position_is_open_to(position, attributes)
+                }
+
+        # 2. sort the entries into counted / already voted / rejected
+        candidates = ballots._candidate_positions(election)
+        voted_rows, votes, packed, ranked = [], [], [], []
+        already_voted = rejected = 0
+
+        for entry in entries:
+            profile_id, variant = profiles.get(str(entry.get('student_id')), (None, None))
+            if profile_id is None:
+                rejected += 1
+                continue
+            if profile_id in already:
+                already_voted += 1
+                continue
+
+            try:
+                pairs = [(int(p), int(c)) for p, c in entry.get('choices') or []]
+                rankings = {int(p): [int(c) for c in r] for p, r in (entry.get('rankings') or {}).items()}
+                if not pairs and not rankings:
+                    raise ValueError("empty ballot")
+                if not {p for p, _ in pairs}.union(rankings) <= open_positions[variant]:
+                    raise ValueError("voted for a position they can't vote for")
+                ballots.validate_ballot(election, pairs, rankings, candidates)
+            except (TypeError, ValueError):
+                rejected += 1
+                continue
+
+            # the student_id goes no further than this
+            already.add(profile_id)
+            voted_rows.append(through(studentprofile_id=profile_id, election_id=election.pk))
+            entry_votes, entry_packed, entry_ranked = ballots.build_rows(election, pairs, rankings)
+            votes.extend(entry_votes)
+            packed.extend(entry_packed)
+            ranked.extend(entry_ranked)
+
+        # 3. a handful of bulk inserts for the whole batch. The ballots are shuffled first:
+        #    in entry order ballot row k would belong to the student in voted row k
+        for rows in (votes, packed, ranked):
+            random.SystemRandom().shuffle(rows)
+        through.objects.bulk_create(voted_rows, batch_size=BULK_SIZE)
+        ballots.save_rows(votes, packed, ranked, batch_size=BULK_SIZE)
+
+        record.ingested = len(voted_rows)
+        record.already_voted = already_voted
+        record.rejected = rejected
+        record.save(update_fields=['ingested', 'already_voted', 'rejected'])
+
+        # bulk_create skips the m2m signals, so bump the versions ourselves
+        def bump():
+            versions.bump_tally(election.pk)
+            for row in voted_rows:
+                versions.bump_voter(row.studentprofile_id)
+
+        transaction.on_commit(bump)
+        transaction.on_commit(lambda: participation.sync_soon([election]), robust=True)
+
+    return record
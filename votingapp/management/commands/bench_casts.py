@@ -0,0 +1,249 @@
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from votingapp.models import Candidate, Election, Position, StudentProfile
+
+
+# the csrf secret every benchmark client sends as both its cookie and its form field
+CSRF_SECRET = 'b' * 32
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks sustained casts/sec against gunicorn on a throwaway sqlite database, "
+        "with the 'concurrent' sqlite profile and/or Django's plain sqlite settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile',
+            choices=['concurrent', 'plain', 'both'],
+            default='both',
+            help="Which SQLITE_PROFILE to run (default: both, to compare).",
+        )
+        parser.add_argument('--voters', type=int, default=2000, help="Ballots to cast (default: 2000).")
+        parser.add_argument('--workers', type=int, default=4, help="gunicorn worker processes (default: 4).")
+        parser.add_argument('--threads', type=int, default=4, help="Threads per gunicorn worker (default: 4).")
+        parser.add_argument('--clients', type=int, default=32, help="Voters casting at the same time (default: 32).")
+        parser.add_argument('--positions', type=int, default=5, help="Positions on the ballot (default: 5).")
+        # internal: fills the throwaway database, run in a subprocess pointed at it
+        parser.add_argument('--prepare', metavar='OUT_FILE', help="(internal)")
+
+    # ---------- setting up the throwaway database ----------
+
+    def _prepare(self, out_file, voters, positions):
+        now = timezone.now()
+        User = get_user_model()
+
+        with transaction.atomic():
+            election = Election.objects.create(
+                name='Benchmark', start_time=now - timedelta(hours=1), end_time=now + timedelta(days=1)
+            )
+            ballot = {}
+            for p in range(positions):
+                position = Position.objects.create(election=election, name=f'Position {p + 1}')
+                ballot[position.pk] = [
+                    Candidate.objects.create(position=position, name=f'Candidate {p + 1}.{c + 1}').pk
+                    for c in range(3)
+                ]
+
+            User.objects.bulk_create(
+                [User(username=f'bench{i}', password='!') for i in range(voters)], batch_size=1000
+            )
+            users = list(User.objects.filter(username__startswith='bench').order_by('pk'))
+            StudentProfile.objects.bulk_create(
+                [StudentProfile(user=user, student_id=f'B{i:06d}') for i, user in enumerate(users)],
+                batch_size=1000,
+            )
+
+        # logged in sessions, so the benchmark doesn't time password hashing
+        session_keys = []
+        for user in users:
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            session_keys.append(session.session_key)
+
+        with open(out_file, 'w') as f:
+            json.dump({'election': election.pk, 'ballot': ballot, 'sessions': session_keys}, f)
+
+    # ---------- one run ----------
+
+    def _run(self, profile, options):
+        workdir = tempfile.mkdtemp(prefix='bench-casts-')
+        db_path = os.path.join(workdir, 'bench.sqlite3')
+        env = dict(
+            os.environ,
+            DATABASE_URL=f'sqlite:///{db_path}',
+            SQLITE_PROFILE=profile,
+            # the throwaway database's own cache table, never a shared redis
+            REDIS_URL='',
+            DEBUG='False',
+            WARM_WORKERS='True',
+        )
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+
+        def call(*args):
+            result = subprocess.run(manage + list(args), env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+            if result.returncode:
+                raise CommandError(f"{' '.join(args)} failed:\n{result.stderr[-2000:]}")
+
+        call('migrate', '-v0')
+        setup_file = os.path.join(workdir, 'setup.json')
+        call('bench_casts', '--prepare', setup_file,
+             '--voters', str(options['voters']), '--positions', str(options['positions']))
+        with open(setup_file) as f:
+            setup = json.load(f)
+
+        port = _free_port()
+        log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', settings.WSGI_APPLICATION.replace('.application', ':application'),
+             '--config', os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'),
+             '--workers', str(options['workers']), '--threads', str(options['threads']),
+             '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+            env=env, cwd=settings.BASE_DIR, stdout=log, stderr=log,
+        )
+        try:
+            self._wait_for(port, server, log.name)
+            results, elapsed = self._cast_all(port, setup, options['clients'])
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+            log.close()
+
+        # count what actually got stored, straight from the file
+        with sqlite3.connect(db_path) as db:
+            voted = db.execute('SELECT COUNT(*) FROM votingapp_studentprofile_voted_in_elections').fetchone()[0]
+            votes = db.execute('SELECT COUNT(*) FROM votingapp_vote').fetchone()[0]
+            packed = db.execute('SELECT COUNT(*) FROM votingapp_ballot').fetchone()[0]
+
+        shutil.rmtree(workdir)
+        return results, elapsed, voted, votes, packed
+
+    def _wait_for(self, port, server, log_path):
+        # until gunicorn answers
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"gunicorn exited, see {log_path}")
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                connection.request('GET', reverse('login_view'))
+                connection.getresponse().read()
+                connection.close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError("gunicorn didn't start within 60s.")
+
+    def _cast_all(self, port, setup, clients):
+        path = reverse('cast_ballot_view', args=[setup['election']])
+        thank_you = reverse('thank_you_view')
+        sessions = list(setup['sessions'])
+        ballot = setup['ballot']
+        lock = threading.Lock()
+        results = []
+
+        def client():
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            while True:
+                with lock:
+                    if not sessions:
+                        break
+                    session_key = sessions.pop()
+
+                form = {position: random.choice(candidates) for position, candidates in ballot.items()}
+                form.update(csrfmiddlewaretoken=CSRF_SECRET, ballot_token=uuid.uuid4().hex)
+                headers = {
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'Cookie': f'{settings.SESSION_COOKIE_NAME}={session_key}; {settings.CSRF_COOKIE_NAME}={CSRF_SECRET}',
+                    'Host': 'localhost',
+                }
+
+                started = time.perf_counter()
+                try:
+                    connection.request('POST', path, body=urlencode(form), headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    ok = response.status == 302 and response.getheader('Location', '').endswith(thank_you)
+                except (OSError, http.client.HTTPException):
+                    ok = False
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+                latency = (time.perf_counter() - started) * 1000
+
+                with lock:
+                    results.append((ok, latency))
+            connection.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    # ---------- report ----------
+
+    def handle(self, *args, **options):
+        if options['prepare']:
+            self._prepare(options['prepare'], options['voters'], options['positions'])
+            return
+
+        profiles = ['plain', 'concurrent'] if options['profile'] == 'both' else [options['profile']]
+        self.stdout.write(
+            f"{options['voters']} ballots of {options['positions']} positions, {options['clients']} clients, "
+            f"gunicorn {options['workers']} workers x {options['threads']} threads"
+        )
+
+        for profile in profiles:
+            results, elapsed, voted, votes, packed = self._run(profile, options)
+            succeeded = sum(1 for ok, _ in results if ok)
+            latencies = sorted(latency for _, latency in results)
+
+            self.stdout.write("")
+            self.stdout.write(f"SQLITE_PROFILE={profile}")
+            self.stdout.write(f"  counted                    {succeeded:>8} of {len(results)}")
+            self.stdout.write(f"  failed                     {len(results) - succeeded:>8}")
+            self.stdout.write(self.style.SUCCESS(f"  sustained casts/sec        {succeeded / elapsed:>8.1f}"))
+            self.stdout.write(
+                f"  latency ms                 p50 {_percentile(latencies, 50):.0f}  p95 {_percentile(latencies, 95):.0f}"
+                f"  p99 {_percentile(latencies, 99):.0f}  max {latencies[-1] if latencies else 0:.0f}"
+            )
+            self.stdout.write(f"  stored                     {voted} voters, {votes} vote rows, {packed} packed ballots")
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from votingapp.eligibility import eligible_counts, eligible_non_voter_ids
+from votingapp.models import Election, StudentProfile
+
+
+class Command(BaseCommand):
+    help = "Shows how many students are eligible for each position of an election."
+
+    def add_arguments(self, parser):
+        parser.add_argument('election_id', type=int)
+        parser.add_argument(
+            '--non-voters',
+            action='store_true',
+            help="Also list the student ids of eligible students who have not voted yet.",
+        )
+        parser.add_argument(
+            '--position',
+            type=int,
+            help="Only list non-voters eligible for this position id.",
+        )
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            help="Ignore the cached masks and reload the roster.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            election = Election.objects.get(pk=options['election_id'])
+        except Election.DoesNotExist:
+            raise CommandError(f"Election {options['election_id']} does not exist.")
+
+        counts = eligible_counts(election, refresh=options['refresh'])
+
+        self.stdout.write(f"Eligibility for {election.name}")
+        for position in election.positions.all():
+            self.stdout.write(f"  {position.name:<40} {counts.get(position.pk, 0):>8}")
+
+        if options['non_voters'] or options['position']:
+            profile_ids = eligible_non_voter_ids(election, position_id=options['position'])
+            student_ids = StudentProfile.objects.filter(
+                pk__in=profile_ids
+            ).order_by('student_id').values_list('student_id', flat=True)
+
+            self.stdout.write(f"\nEligible students yet to vote: {len(profile_ids)}")
+            for student_id in student_ids.iterator():
+                self.stdout.write(student_id)
@@ -0,0 +1,417 @@
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import Count
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+
+from votingapp.ballots import pack_ranking
+from votingapp.models import (
+    Candidate, Election, Position, RankedBallot, StudentProfile, TurnoutMinute, Vote,
+)
+
+
+# the migration with the indexes this command proposed, --synthetic times the queries
+# on both sides of it
+INDEX_MIGRATION = ('votingapp', '0012_hot_path_indexes')
+
+# a table this small is scanned and sorted in no time, so it gets no flags or indexes
+SMALL_TABLE = 1000
+
+# (name, where it runs, queryset, (model, fields) of the index that would serve it or None)
+HotQuery = namedtuple('HotQuery', 'name used_by queryset index')
+
+
+def hot_queries(election):
+    """
+    The queries behind the voter pages and the results page, built the same way the
+    views (and the helpers they call) build them. Keep in step with views.py.
+    """
+    now = timezone.now()
+    profile = election.voters.order_by('pk').first() or StudentProfile.objects.order_by('pk').first()
+    ranked = election.positions.filter(voting_method__in=('irv', 'stv')).order_by('pk').first()
+    through = StudentProfile.voted_in_elections.through
+
+    queries = [
+        HotQuery(
+            'open elections', 'election_list_view',
+            Election.objects.filter(start_time__lte=now, end_time__gte=now).order_by('end_time'),
+            (Election, ['end_time', 'start_time']),
+        ),
+        HotQuery(
+            'open election by id', 'ballot_view',
+            Election.objects.filter(pk=election.pk, start_time__lte=now, end_time__gte=now),
+            None,
+        ),
+        HotQuery(
+            'all elections', 'results_dashboard_view',
+            Election.objects.all().order_by('-start_time'),
+            (Election, ['-start_time']),
+        ),
+        HotQuery(
+            'lock voter', 'cast_ballot_view',
+            StudentProfile.objects.filter(user_id=profile.user_id) if profile else None,
+            None,
+        ),
+        HotQuery(
+            'has voted', 'election_list_view, ballot_view, cast_ballot_view',
+            profile.voted_in_elections.all() if profile else None,
+            None,
+        ),
+        HotQuery(
+            'participation rows', 'participation.load (results, turnout)',
+            through.objects.filter(election_id=election.pk, pk__gt=0).order_by('pk').values_list('pk', 'studentprofile_id'),
+            None,
+        ),
+        HotQuery(
+            'eligible students', 'eligibility masks (results, ballot json)',
+            StudentProfile.objects.filter(is_eligible=True).values_list('pk', 'gender', 'sponsorship_type', 'session_category'),
+            None,
+        ),
+        HotQuery(
+            'positions', 'election_results_view, ballot json',
+            election.positions.all(),
+            None,
+        ),
+        HotQuery(
+            'candidates with votes', 'election_results_view (ballots.candidates_with_votes)',
+            Candidate.objects.filter(position__election=election)
+            .annotate(vote_count=Count('votes'))
+            .order_by('position', '-vote_count'),
+            (Vote, ['candidate']),
+        ),
+        HotQuery(
+            'ranked ballots grouped', 'election_results_view (tabulation)',
+            RankedBallot.objects.filter(position=ranked)
+            .values('ranking')
+            .annotate(n=Count('id'))
+            .values_list('ranking', 'n') if ranked else None,
+            (RankedBallot, ['position', 'ranking']),
+        ),
+        HotQuery(
+            'turnout minutes', 'election_turnout_view',
+            TurnoutMinute.objects.filter(election=election).order_by('minute'),
+            None,
+        ),
+        HotQuery(
+            'votes per minute', 'turnout.backfill',
+            Vote.objects.filter(position__election=election)
+            .annotate(minute=TruncMinute('timestamp'))
+            .values('minute')
+            .annotate(n=Count('id'))
+            .order_by('minute'),
+            # grouped on a function of the timestamp, so no index saves the sort
+            None,
+        ),
+    ]
+    return [query for query in queries if query.queryset is not None]
+
+
+# ---------- reading the plans ----------
+
+def _sqlite_flags(plan):
+    # EXPLAIN QUERY PLAN lines look like "3 0 0 SCAN votingapp_vote USING INDEX ..."
+    flags = []
+    for line in plan.splitlines():
+        detail = line.split(' ', 3)[-1]
+        if detail.startswith('SCAN ') and 'USING' not in detail:
+            flags.append(('scan', detail.split()[1]))
+        elif detail.startswith('USE TEMP B-TREE'):
+            flags.append(('sort', detail[len('USE TEMP B-TREE FOR '):]))
+    return flags
+
+
+def _postgres_flags(plan):
+    # walks EXPLAIN (FORMAT JSON) nodes; spills only show up with ANALYZE
+    flags = []
+
+    def walk(node):
+        kind = node.get('Node Type')
+        if kind == 'Seq Scan':
+            flags.append(('scan', node.get('Relation Name')))
+        elif kind in ('Sort', 'Incremental Sort'):
+            if node.get('Sort Space Type') == 'Disk':
+                flags.append(('spill', f"sort on {', '.join(node.get('Sort Key', []))} used {node.get('Sort Space Used')} kB of disk"))
+            else:
+                flags.append(('sort', ', '.join(node.get('Sort Key', []))))
+        elif kind == 'Hash' and node.get('Hash Batches', 1) > 1:
+            flags.append(('spill', f"hash in {node['Hash Batches']} batches"))
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(json.loads(plan)[0]['Plan'])
+    return flags
+
+
+def _table_rows(table):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0]
+
+
+def _index_exists(model, fields):
+    # any index or unique constraint that starts with these columns
+    columns = [model._meta.get_field(field.lstrip('-')).column for field in fields]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    return any(
+        (info['index'] or info['unique']) and info['columns'][:len(columns)] == columns
+        for info in constraints.values()
+    )
+
+
+def _timed(queryset, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        list(queryset.all())
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def analyze(election, repeat=3, explain_analyze=False):
+    """EXPLAINs and times every hot query. Returns a list of dicts, one per query."""
+    postgres = connection.vendor == 'postgresql'
+    row_counts = {}
+    report = []
+
+    for query in hot_queries(election):
+        if postgres:
+            extra = {'analyze': True, 'buffers': True} if explain_analyze else {}
+            plan = query.queryset.explain(format='json', **extra)
+            flags = _postgres_flags(plan)
+        else:
+            plan = query.queryset.explain()
+            flags = _sqlite_flags(plan)
+
+        def rows(table):
+            if table not in row_counts:
+                row_counts[table] = _table_rows(table)
+            return row_counts[table]
+
+        # a scan over a handful of rows isn't worth an index
+        for i, (kind, table) in enumerate(flags):
+            if kind == 'scan' and rows(table) < SMALL_TABLE:
+                flags[i] = ('small scan', f'{table} ({rows(table)} rows)')
+
+        proposal = None
+        if query.index and any(kind in ('scan', 'sort', 'spill') for kind, _ in flags):
+            model, fields = query.index
+            if rows(model._meta.db_table) >= SMALL_TABLE and not _index_exists(model, fields):
+                proposal = f"models.Index(fields={fields!r}) on {model.__name__}"
+
+        report.append({
+            'name': query.name,
+            'used_by': query.used_by,
+            'plan': plan if postgres else plan.splitlines(),
+            'flags': flags,
+            'proposal': proposal,
+            'ms': _timed(query.queryset, repeat),
+        })
+    return report
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAINs the queries behind the voting and results pages on the configured database, "
+        "flags full scans and sorts, and proposes the indexes that would serve them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('election_id', nargs='?', type=int, help="Election to check (default: the latest).")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs of each query to time (default: 3).")
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help="PostgreSQL: use EXPLAIN ANALYZE, which runs the query and shows sorts that spill to disk.",
+        )
+        parser.add_argument('--plans', action='store_true', help="Print every query plan.")
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            metavar='VOTERS',
+            help=f"Build a throwaway sqlite database with this many voters per election and compare "
+                 f"the queries before and after {INDEX_MIGRATION[1]}.",
+        )
+        parser.add_argument('--elections', type=int, default=4, help="Elections in the synthetic database (default: 4).")
+        # internal: run inside the throwaway database
+        parser.add_argument('--fill', action='store_true', help="(internal)")
+        parser.add_argument('--json', metavar='OUT_FILE', help="(internal)")
+
+    # ---------- the synthetic database ----------
+
+    def _fill(self, voters, elections):
+        now = timezone.now()
+        User = get_user_model()
+        through = StudentProfile.voted_in_elections.through
+        rng = random.Random(41)
+
+        with transaction.atomic():
+            User.objects.bulk_create([User(username=f'synth{i}', password='!') for i in range(voters)], batch_size=2000)
+            users = User.objects.filter(username__startswith='synth').order_by('pk')
+            StudentProfile.objects.bulk_create(
+                [
+                    StudentProfile(
+                        user=user, student_id=f'Y{i:07d}',
+                        gender=rng.choice(['Male', 'Female']),
+                        sponsorship_type=rng.choice(['Government', 'Private']),
+                        session_category=rng.choice(['Weekday', 'Weekend']),
+                    )
+                    for i, user in enumerate(users.iterator())
+                ],
+                batch_size=2000,
+            )
+            profile_ids = list(StudentProfile.objects.order_by('pk').values_list('pk', flat=True))
+
+        # past elections first, the last one is open now
+        for e in range(elections):
+            start = now - timedelta(days=365 * (elections - 1 - e), hours=4)
+            election = Election.objects.create(name=f'Synthetic {e + 1}', start_time=start, end_time=start + timedelta(days=1))
+            plurality = []
+            ranked = []
+            for p in range(6):
+                method = 'irv' if p >= 4 else 'plurality'
+                position = Position.objects.create(election=election, name=f'Position {p + 1}', voting_method=method)
+                candidate_ids = [
+                    Candidate.objects.create(position=position, name=f'Candidate {p + 1}.{c + 1}').pk
+                    for c in range(5 if method == 'irv' else 4)
+                ]
+                (ranked if method == 'irv' else plurality).append((position.pk, candidate_ids))
+
+            # 85% turnout, everyone votes within the first 8 hours
+            voted = rng.sample(profile_ids, int(voters * 0.85))
+            voted_rows = [(profile_id, election.pk) for profile_id in voted]
+            vote_rows = []
+            ranked_rows = []
+            for _ in voted:
+                when = start + timedelta(seconds=rng.randrange(8 * 3600))
+                for position_id, candidate_ids in plurality:
+                    vote_rows.append((rng.choice(candidate_ids), position_id, when))
+                for position_id, candidate_ids in ranked:
+                    ranking = rng.sample(candidate_ids, rng.randint(1, 3))
+                    ranked_rows.append((position_id, when, pack_ranking(ranking)))
+
+            self._insert(through, ['studentprofile_id', 'election_id'], voted_rows)
+            self._insert(Vote, ['candidate_id', 'position_id', 'timestamp'], vote_rows)
+            self._insert(RankedBallot, ['position_id', 'timestamp', 'ranking'], ranked_rows)
+
+    def _insert(self, model, columns, rows):
+        # straight executemany, bulk_create is far too slow for millions of rows
+        table = connection.ops.quote_name(model._meta.db_table)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        fields = [model._meta.get_field(column.removesuffix('_id')) for column in columns]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for i in range(0, len(rows), 10000):
+                cursor.executemany(sql, [
+                    [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+                    for row in rows[i:i + 10000]
+                ])
+
+    def _synthetic(self, voters, options):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        if INDEX_MIGRATION not in loader.graph.nodes:
+            raise CommandError(f"Migration {INDEX_MIGRATION[1]} not found.")
+        before = [parent for parent in loader.graph.node_map[INDEX_MIGRATION].parents if parent.key[0] == 'votingapp'][0].key
+
+        workdir = tempfile.mkdtemp(prefix='index-advisor-')
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'synthetic.sqlite3')}",
+            # the throwaway database's own cache table, never a shared redis
+            REDIS_URL='',
+            DEBUG='False',
+        )
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+
+        def call(*args):
+            result = subprocess.run(manage + list(args), env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+            if result.returncode:
+                raise CommandError(f"{' '.join(args)} failed:\n{result.stderr[-2000:]}")
+
+        try:
+            self.stdout.write(f"Building {options['elections']} elections x {voters} voters in {workdir} ...")
+            call('migrate', '-v0')
+            call('migrate', 'votingapp', before[1], '-v0')
+            # going back also took out the cache table (migration 0016), the fill needs it
+            call('createcachetable')
+            started = time.perf_counter()
+            call('index_advisor', '--fill', '--synthetic', str(voters), '--elections', str(options['elections']))
+            self.stdout.write(f"  filled in {time.perf_counter() - started:.0f}s")
+
+            reports = {}
+            for label, target in (('before', before[1]), ('after', INDEX_MIGRATION[1])):
+                call('migrate', 'votingapp', target, '-v0')
+                out = os.path.join(workdir, f'{label}.json')
+                call('index_advisor', '--json', out, '--repeat', str(options['repeat']))
+                with open(out) as f:
+                    reports[label] = json.load(f)
+        finally:
+            shutil.rmtree(workdir)
+
+        self.stdout.write("")
+        self.stdout.write(f"{'query':<26} {'before ms':>10} {'after ms':>10}  {'speedup':>8}  flags before -> after")
+        for before_row, after_row in zip(reports['before'], reports['after']):
+            speedup = before_row['ms'] / after_row['ms'] if after_row['ms'] else 0
+            line = (
+                f"{before_row['name']:<26} {before_row['ms']:>10.1f} {after_row['ms']:>10.1f}  {speedup:>7.1f}x  "
+                f"{_flag_text(before_row['flags'])} -> {_flag_text(after_row['flags'])}"
+            )
+            self.stdout.write(self.style.SUCCESS(line) if speedup >= 1.5 else line)
+
+    # ---------- report ----------
+
+    def handle(self, *args, **options):
+        if options['fill']:
+            self._fill(options['synthetic'], options['elections'])
+            return
+        if options['synthetic'] and not options['json']:
+            self._synthetic(options['synthetic'], options)
+            return
+
+        if options['election_id']:
+            election = Election.objects.filter(pk=options['election_id']).first()
+        else:
+            election = Election.objects.order_by('-start_time').first()
+        if election is None:
+            raise CommandError("No such election.")
+
+        report = analyze(election, repeat=options['repeat'], explain_analyze=options['analyze'])
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f)
+            return
+
+        self.stdout.write(f"Hot queries for {election.name} on {connection.vendor}")
+        for row in report:
+            self.stdout.write("")
+            self.stdout.write(f"{row['name']}  ({row['used_by']})  {row['ms']:.1f} ms")
+            if options['plans']:
+                plan = row['plan'] if isinstance(row['plan'], list) else [row['plan']]
+                for line in plan:
+                    self.stdout.write(f"    {line}")
+            for kind, detail in row['flags']:
+                style = self.style.WARNING if kind in ('scan', 'spill') else (lambda text: text)
+                self.stdout.write(style(f"  {kind:<11} {detail}"))
+            if row['proposal']:
+                self.stdout.write(self.style.SUCCESS(f"  add         {row['proposal']}"))
+        if connection.vendor == 'postgresql' and not options['analyze']:
+            self.stdout.write("")
+            self.stdout.write("Sorts are listed without knowing whether they spill, run with --analyze to see.")
+
+
+def _flag_text(flags):
+    return ', '.join(f'{kind} {detail}' for kind, detail in flags if kind != 'small scan') or 'ok'
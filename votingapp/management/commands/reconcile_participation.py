@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from votingapp import participation
+from votingapp.models import Election
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the participation bitmaps from the voted_in_elections table. "
+        "Safe to run from cron as a safety net."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'election_ids',
+            nargs='*',
+            type=int,
+            help="Elections to rebuild (all of them when left out).",
+        )
+
+    def handle(self, *args, **options):
+        elections = Election.objects.all()
+        if options['election_ids']:
+            elections = elections.filter(pk__in=options['election_ids'])
+            if not elections.exists():
+                raise CommandError("None of those elections exist.")
+
+        for election in elections:
+            before, after = participation.reconcile(election)
+            status = "ok" if before == after else f"fixed ({before} -> {after})"
+            self.stdout.write(f"{election.name}: {after} voters, {status}")
@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from votingapp import images
+
+
+def _init_worker():
+    # each worker process needs django set up and its own database connection
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Regenerates the resized WebP/JPEG variants of candidate photos, party logos and symbols."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes (default: one per CPU).",
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help="Regenerate even if the source image hasn't changed.",
+        )
+
+    def handle(self, *args, **options):
+        sources = images.all_sources()
+        if not sources:
+            self.stdout.write("No images to process.")
+            return
+
+        # don't hand our open connection down to the forked workers
+        connections.close_all()
+
+        generated = skipped = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            futures = [
+                pool.submit(images.regenerate_in_worker, source, options['force'])
+                for source in sources
+            ]
+            for future in as_completed(futures):
+                source, did_generate, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{source}: {error}")
+                elif did_generate:
+                    generated += 1
+                    self.stdout.write(f"{source}: generated")
+                else:
+                    skipped += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{generated} generated, {skipped} unchanged, {failed} failed"
+        ))
@@ -0,0 +1,167 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+
+MARKER = 'STARTUP-PROFILE:'
+
+# What a freshly started worker does: load the wsgi app, then answer two requests.
+# Runs in a clean interpreter so nothing this process already imported skews it.
+WORKER_SCRIPT = r'''
+import io, json, os, sys, time
+started = time.time()
+
+module_name, _, attribute = os.environ['STARTUP_PROFILE_WSGI'].rpartition('.')
+# a plain __import__ so -X importtime reports it (importlib.import_module bypasses that)
+__import__(module_name)
+application = getattr(sys.modules[module_name], attribute)
+loaded = time.time()
+
+def request(path):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': os.environ['STARTUP_PROFILE_HOST'],
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    status = []
+    response = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    b''.join(response)
+    if hasattr(response, 'close'):
+        response.close()
+    return status[0]
+
+status = request(os.environ['STARTUP_PROFILE_PATH'])
+first = time.time()
+request(os.environ['STARTUP_PROFILE_PATH'])
+second = time.time()
+
+print(os.environ['STARTUP_PROFILE_MARKER'] + json.dumps({
+    'started': started, 'loaded': loaded, 'first': first, 'second': second,
+    'status': status, 'modules': len(sys.modules),
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """
+    Reads python's -X importtime output into [(module, self us, cumulative us, depth)].
+    Lines look like "import time:       143 |     182718 |   django.core.wsgi", where the
+    indentation of the name shows what imported what.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            # the header line
+            continue
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        rows.append((stripped, int(parts[0]), int(parts[1]), (len(name) - len(stripped) - 1) // 2))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Shows what a fresh web worker spends its startup on: imports, app loading and its first request."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=5,
+            help="How many fresh workers to time (default: 5). The median is shown.",
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=15,
+            help="How many packages / imports to list (default: 15).",
+        )
+        parser.add_argument(
+            '--path',
+            default=None,
+            help="Url the worker requests first (default: the login page).",
+        )
+
+    def _run_worker(self, path, importtime=False):
+        env = dict(
+            os.environ,
+            STARTUP_PROFILE_WSGI=settings.WSGI_APPLICATION,
+            STARTUP_PROFILE_PATH=path,
+            STARTUP_PROFILE_HOST='localhost',
+            STARTUP_PROFILE_MARKER=MARKER,
+        )
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        command += ['-c', WORKER_SCRIPT]
+
+        spawned = time.time()
+        result = subprocess.run(command, env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+
+        for line in result.stdout.splitlines():
+            if line.startswith(MARKER):
+                timings = json.loads(line[len(MARKER):])
+                break
+        else:
+            raise CommandError(f"The worker failed to start:\n{result.stderr[-2000:]}")
+
+        timings['spawned'] = spawned
+        return timings, result.stderr
+
+    def handle(self, *args, **options):
+        path = options['path'] or reverse('login_view')
+        top = options['top']
+
+        # --- 1. where the import time goes (one run under -X importtime, which slows things down)
+        _, stderr = self._run_worker(path, importtime=True)
+        rows = parse_importtime(stderr)
+        if not rows:
+            raise CommandError("Got no -X importtime output from the worker.")
+
+        per_package = defaultdict(int)
+        for module, self_us, _, _ in rows:
+            per_package[module.split('.')[0]] += self_us
+        total_us = sum(per_package.values())
+
+        self.stdout.write(f"Imports of a fresh worker: {len(rows)} modules, {total_us / 1000:.1f} ms in total")
+        self.stdout.write("")
+        self.stdout.write("By package (own time of all its modules):")
+        for package, self_us in sorted(per_package.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"  {package:<40} {self_us / 1000:>8.1f} ms  {100 * self_us / total_us:>5.1f}%")
+
+        self.stdout.write("")
+        self.stdout.write("Slowest imports (including everything they import):")
+        # the top two levels: the wsgi module and what it pulls in, then what requests pull in
+        slowest = sorted((row for row in rows if row[3] <= 1), key=lambda row: -row[2])[:top]
+        for module, _, cumulative_us, depth in slowest:
+            self.stdout.write(f"  {'  ' * depth}{module:<{40 - 2 * depth}} {cumulative_us / 1000:>8.1f} ms")
+
+        # --- 2. time to first request, timed without -X importtime
+        runs = [self._run_worker(path)[0] for _ in range(max(1, options['runs']))]
+
+        def median_ms(start, end):
+            return statistics.median((run[end] - run[start]) * 1000 for run in runs)
+
+        self.stdout.write("")
+        self.stdout.write(f"Fresh worker, median of {len(runs)} (GET {path} -> {runs[0]['status']}):")
+        self.stdout.write(f"  interpreter start          {median_ms('spawned', 'started'):>8.1f} ms")
+        self.stdout.write(f"  load the wsgi app          {median_ms('started', 'loaded'):>8.1f} ms")
+        self.stdout.write(f"  first request              {median_ms('loaded', 'first'):>8.1f} ms")
+        self.stdout.write(f"  second request             {median_ms('first', 'second'):>8.1f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"  time to first request      {median_ms('spawned', 'first'):>8.1f} ms"
+            f"  ({runs[0]['modules']} modules loaded)"
+        ))
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from votingapp import turnout
+from votingapp.models import Election
+
+
+class Command(BaseCommand):
+    help = "Shows an election's voting speed per minute and the peak load, for sizing workers next time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('election_id', type=int)
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help="Rebuild the per-minute counts from the vote timestamps first.",
+        )
+        parser.add_argument(
+            '--cast-ms',
+            type=float,
+            default=50,
+            help="How long one cast takes a worker, in milliseconds (default: 50).",
+        )
+        parser.add_argument(
+            '--headroom',
+            type=float,
+            default=2.0,
+            help="Safety factor on the peak for bursts within a minute (default: 2).",
+        )
+        parser.add_argument(
+            '--minutes',
+            action='store_true',
+            help="Also list every minute.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            election = Election.objects.get(pk=options['election_id'])
+        except Election.DoesNotExist:
+            raise CommandError(f"Election {options['election_id']} does not exist.")
+
+        if options['backfill']:
+            written = turnout.backfill(election)
+            self.stdout.write(f"Rebuilt {written} minutes from the vote timestamps.")
+
+        minutes = turnout.series(election)
+        report = turnout.capacity(minutes, cast_ms=options['cast_ms'], headroom=options['headroom'])
+        if report is None:
+            self.stdout.write("No ballots recorded for this election yet (try --backfill).")
+            return
+
+        if options['minutes']:
+            for minute, ballots, votes in minutes:
+                self.stdout.write(f"  {minute:%Y-%m-%d %H:%M}  {ballots:>6} ballots  {votes:>7} votes")
+            self.stdout.write("")
+
+        self.stdout.write(f"Turnout of {election.name}")
+        self.stdout.write(f"  ballots                    {report['ballots']:>10}")
+        self.stdout.write(f"  minutes with voting        {report['minutes']:>10}")
+        self.stdout.write(
+            f"  busiest minute             {report['busiest_minute']:%Y-%m-%d %H:%M} "
+            f"({report['peak_per_minute']} ballots)"
+        )
+        self.stdout.write(f"  peak ballots/sec           {report['peak_per_sec']:>10}")
+        for p, per_sec in report['percentiles_per_sec'].items():
+            self.stdout.write(f"  p{p} ballots/sec            {per_sec:>10}")
+        self.stdout.write(self.style.SUCCESS(
+            f"  busy workers needed        {report['workers_needed']:>10}"
+            f"  (peak x {report['cast_ms']:g} ms per cast x {report['headroom']:g} headroom)"
+        ))
@@ -0,0 +1,100 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from votingapp import warmup
+from votingapp.models import Election
+
+
+class Command(BaseCommand):
+    help = "Builds every cache an election needs before it opens, so the first voters don't have to."
+
+    def add_arguments(self, parser):
+        parser.add_argument('election_id', type=int)
+        parser.add_argument(
+            '--before-minutes',
+            type=float,
+            help="Wait until this many minutes before the election opens, then warm up.",
+        )
+        parser.add_argument(
+            '--ping',
+            metavar='BASE_URL',
+            help="Also send requests to the running site (e.g. https://vote.example.ac) so its workers warm up.",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help="Parallel requests for --ping, at least the number of workers (default: 8).",
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=32,
+            help="Requests per page for --ping (default: 32).",
+        )
+
+    def _write_steps(self, steps):
+        for name, detail, ms in steps:
+            self.stdout.write(f"  {name:<24} {ms:>9.1f} ms  {detail}")
+
+    def _ping(self, base_url, concurrency, count):
+        # spread over the workers: each one that answers opens its connection and
+        # loads its templates and urls (on top of warm_process at boot)
+        paths = [reverse('login_view'), reverse('election_list_view')]
+        urls = [base_url.rstrip('/') + path for path in paths for _ in range(count)]
+
+        def fetch(url):
+            started = time.perf_counter()
+            try:
+                with urlopen(url, timeout=30) as response:
+                    response.read()
+                    status = response.status
+            except URLError as e:
+                status = getattr(e, 'code', None) or str(e.reason)
+            return url, status, (time.perf_counter() - started) * 1000
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(fetch, urls))
+
+        for path in paths:
+            url = base_url.rstrip('/') + path
+            timings = sorted(ms for u, _, ms in results if u == url)
+            statuses = sorted({str(status) for u, status, _ in results if u == url})
+            self.stdout.write(
+                f"  GET {path:<20} x{len(timings)}  slowest {timings[-1]:.0f} ms, "
+                f"median {timings[len(timings) // 2]:.0f} ms  ({', '.join(statuses)})"
+            )
+
+    def handle(self, *args, **options):
+        try:
+            election = Election.objects.get(pk=options['election_id'])
+        except Election.DoesNotExist:
+            raise CommandError(f"Election {options['election_id']} does not exist.")
+
+        if options['before_minutes'] is not None:
+            warm_at = election.start_time - timedelta(minutes=options['before_minutes'])
+            wait = (warm_at - timezone.now()).total_seconds()
+            if wait > 0:
+                self.stdout.write(f"Waiting until {timezone.localtime(warm_at):%Y-%m-%d %H:%M:%S} to warm up...")
+                time.sleep(wait)
+
+        started = time.perf_counter()
+
+        self.stdout.write(f"Warming {election.name}")
+        self._write_steps(warmup.warm_election(election))
+
+        if options['ping']:
+            self.stdout.write("Warming the site's workers")
+            self._ping(options['ping'], options['concurrency'], options['requests'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {(time.perf_counter() - started):.2f}s, "
+            f"opens {timezone.localtime(election.start_time):%Y-%m-%d %H:%M}."
+        ))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0004_alter_party_name_alter_position_limit_by_session_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElectionParticipation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bitmap', models.BinaryField(default=b'')),
+                ('voter_count', models.PositiveIntegerField(default=0)),
+                ('watermark', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('election', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='participation', to='votingapp.election')),
+            ],
+        ),
+    ]
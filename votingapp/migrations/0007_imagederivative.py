@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0006_ballot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('widths', models.JSONField(default=list)),
+                ('generated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
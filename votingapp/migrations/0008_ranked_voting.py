@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0007_imagederivative'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='position',
+            name='seats',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='position',
+            name='voting_method',
+            field=models.CharField(choices=[('plurality', 'Single choice (most votes wins)'), ('approval', 'Approval (tick as many as you like)'), ('irv', 'Instant runoff (rank the candidates)'), ('stv', 'Single transferable vote (rank, several seats)')], default='plurality', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='RankedBallot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('ranking', models.BinaryField()),
+                ('position', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranked_ballots', to='votingapp.position')),
+            ],
+        ),
+    ]
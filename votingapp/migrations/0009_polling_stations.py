@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:51
+
+import django.db.models.deletion
+import votingapp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0008_ranked_voting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollingStation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('secret', models.CharField(default=votingapp.models._station_secret, max_length=64)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KioskBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.CharField(max_length=64)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('ingested', models.PositiveIntegerField(default=0)),
+                ('already_voted', models.PositiveIntegerField(default=0)),
+                ('rejected', models.PositiveIntegerField(default=0)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='kiosk_batches', to='votingapp.election')),
+                ('station', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='batches', to='votingapp.pollingstation')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('station', 'batch_id'), name='unique_station_batch')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 16:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0009_polling_stations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TurnoutMinute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('ballots', models.PositiveIntegerField(default=0)),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnout_minutes', to='votingapp.election')),
+            ],
+            options={
+                'ordering': ['election', 'minute'],
+                'constraints': [models.UniqueConstraint(fields=('election', 'minute'), name='unique_election_minute')],
+            },
+        ),
+    ]
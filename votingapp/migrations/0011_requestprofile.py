@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0010_turnoutminute'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_name', models.CharField(db_index=True, max_length=100)),
+                ('path', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('trigger', models.CharField(choices=[('staff', 'Asked for by staff'), ('sampled', 'Random sample')], max_length=10)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('duration_ms', models.FloatField()),
+                ('samples', models.PositiveIntegerField()),
+                ('sql_count', models.PositiveIntegerField()),
+                ('sql_ms', models.FloatField()),
+                ('stacks', models.TextField()),
+                ('queries', models.JSONField(default=list)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0011_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rankedballot',
+            index=models.Index(fields=['position', 'ranking'], name='rankedballot_position_idx'),
+        ),
+        # the index above starts with position, so the foreign key's own one is redundant
+        migrations.AlterField(
+            model_name='rankedballot',
+            name='position',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ranked_ballots', to='votingapp.position'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0012_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='electionparticipation',
+            name='seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='electionparticipation',
+            name='seen_watermark',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 17:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0013_participation_settle'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CastToken',
+            fields=[
+                ('pk', models.CompositePrimaryKey('user', 'election', 'token', blank=True, editable=False, primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cast_tokens', to='votingapp.election')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cast_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.cache.backends.db import DatabaseCache
+from django.core.management import call_command
+from django.db import migrations
+from django.utils.module_loading import import_string
+
+
+def create_cache_table(apps, schema_editor):
+    # the DatabaseCache table (settings.CACHES without REDIS_URL). Without it the first
+    # request fails, so it comes with migrate rather than a separate createcachetable step.
+    # Does nothing when the cache is Redis or the table is already there
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+def drop_cache_table(apps, schema_editor):
+    for cache in settings.CACHES.values():
+        if issubclass(import_string(cache['BACKEND']), DatabaseCache):
+            schema_editor.execute(f"DROP TABLE IF EXISTS {schema_editor.quote_name(cache['LOCATION'])}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('votingapp', '0015_cast_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, drop_cache_table),
+    ]
@@ -1,3 +1,5 @@
+import secrets
+
 # link to django models module
 from django.db import models
 # link to settings.py 
@@ -98,6 +100,22 @@ class Position(models.Model):
         null=True
     )
     
+    # --------- HOW THE SEAT IS DECIDED ------
+    VOTING_METHOD_CHOICES = [
+        ('plurality', 'Single choice (most votes wins)'),
+        ('approval', 'Approval (tick as many as you like)'),
+        ('irv', 'Instant runoff (rank the candidates)'),
+        ('stv', 'Single transferable vote (rank, several seats)'),
+    ]
+    
+    voting_method = models.CharField(max_length=10, choices=VOTING_METHOD_CHOICES, default='plurality')
+    
+    # how many candidates win this position
+    seats = models.PositiveSmallIntegerField(default=1)
+    
+    @property
+    def is_ranked(self):
+        return self.voting_method in ('irv', 'stv')
     
     def __str__(self):
         return f"{self.name} ({self.election.name})"
@@ -177,4 +195,193 @@ class Vote(models.Model):
     # the time the vote was cast
     timestamp = models.DateTimeField(auto_now_add=True)
     
-    # there is no link between the vote and the student that cast it!
\ No newline at end of file
+    # there is no link between the vote and the student that cast it!
+
+# ---------------------- participation bitmap per election ----
+class ElectionParticipation(models.Model):
+    # one compact bitmap per election: bit N is set when the student profile with pk N has voted.
+    # the voted_in_elections table stays the source of truth, this is folded in from it in batches
+    election = models.OneToOneField(Election, related_name="participation", on_delete=models.CASCADE)
+
+    # zlib compressed little-endian bitmap
+    bitmap = models.BinaryField(default=b'')
+
+    # popcount of the bitmap, so turnout is a single column read
+    voter_count = models.PositiveIntegerField(default=0)
+
+    # every voted_in_elections row up to this id is in the bitmap (see participation.py)
+    watermark = models.BigIntegerField(default=0)
+
+    # the highest row id folded in so far, and when; becomes the watermark once it has settled
+    seen_watermark = models.BigIntegerField(default=0)
+    seen_at = models.DateTimeField(null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Participation for {self.election.name}"
+
+
+# ---------------------- packed ballot (one row per voter) ----
+class Ballot(models.Model):
+    # alternative to Vote: the WHOLE anonymous ballot in one row instead of one row per position.
+    # used when settings.VOTE_STORAGE_MODE == 'packed' (see ballots.py)
+    election = models.ForeignKey(Election, related_name="ballots", on_delete=models.CASCADE)
+
+    # the time the ballot was cast
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    # little-endian int64 (position_id, candidate_id) pairs back to back
+    choices = models.BinaryField()
+
+    # just like Vote, there is no link to the student that cast it
+
+
+# ---------------------- ranked ballot (irv / stv positions) ----
+class RankedBallot(models.Model):
+    # one voter's ranking for ONE ranked position.
+    # no index of its own: the (position, ranking) one below covers lookups by position
+    position = models.ForeignKey(Position, related_name="ranked_ballots", on_delete=models.CASCADE, db_index=False)
+
+    # the time the ballot was cast
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    # little-endian int64 candidate ids, first preference first.
+    # identical rankings are identical bytes, so the database can group them for counting
+    ranking = models.BinaryField()
+
+    # no link to the student here either
+
+    class Meta:
+        # tabulation groups a position's identical rankings, this lets it read them in order
+        indexes = [
+            models.Index(fields=['position', 'ranking'], name='rankedballot_position_idx'),
+        ]
+
+
+# ---------------------- resized copies of uploaded images ----
+class ImageDerivative(models.Model):
+    # keeps track of which uploaded images (candidate photos, party logos, symbols)
+    # already have their resized webp/jpeg variants generated (see images.py)
+    source = models.CharField(max_length=255, unique=True)
+
+    # sha256 of the source file when the variants were made, so unchanged images are skipped
+    content_hash = models.CharField(max_length=64)
+
+    # the widths that were actually generated (we never upscale small images)
+    widths = models.JSONField(default=list)
+
+    generated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.source
+
+
+# ---------------------- offline polling stations ----
+def _station_secret():
+    return secrets.token_urlsafe(32)
+
+
+class PollingStation(models.Model):
+    # a kiosk device that can run an election offline and upload the ballots later (see kiosk.py)
+    name = models.CharField(max_length=100, unique=True)
+
+    # shared only with the device: signs its snapshot downloads and its ballot uploads
+    secret = models.CharField(max_length=64, default=_station_secret)
+
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.name
+
+
+class KioskBatch(models.Model):
+    # one uploaded batch of offline ballots. Kept so the same batch is never counted twice
+    station = models.ForeignKey(PollingStation, related_name="batches", on_delete=models.PROTECT)
+    batch_id = models.CharField(max_length=64)
+    election = models.ForeignKey(Election, related_name="kiosk_batches", on_delete=models.CASCADE)
+
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    # what happened to the batch's ballots
+    ingested = models.PositiveIntegerField(default=0)
+    already_voted = models.PositiveIntegerField(default=0)
+    rejected = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['station', 'batch_id'], name='unique_station_batch'),
+        ]
+
+    def __str__(self):
+        return f"{self.station.name} batch {self.batch_id}"
+
+
+# ---------------------- ballot tokens ----
+class CastToken(models.Model):
+    # the ballot_token of a form that was counted, saved in the same transaction as the vote
+    # (see idempotency.py). Only says "this form was sent", nothing about what was on it.
+    # No timestamp and no running id either: nothing here may line up with the ballot rows
+    pk = models.CompositePrimaryKey('user', 'election', 'token')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="cast_tokens", on_delete=models.CASCADE)
+    election = models.ForeignKey(Election, related_name="cast_tokens", on_delete=models.CASCADE)
+    token = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.user} in {self.election.name}"
+
+
+# ---------------------- turnout per minute ----
+class TurnoutMinute(models.Model):
+    # how many ballots (and individual choices) came in during one minute of an election.
+    # kept up to date on every cast (see turnout.py), so "how fast are people voting"
+    # never has to scan the vote tables
+    election = models.ForeignKey(Election, related_name="turnout_minutes", on_delete=models.CASCADE)
+
+    # the start of the minute (seconds zeroed)
+    minute = models.DateTimeField()
+
+    ballots = models.PositiveIntegerField(default=0)
+    votes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['election', 'minute']
+        constraints = [
+            models.UniqueConstraint(fields=['election', 'minute'], name='unique_election_minute'),
+        ]
+
+    def __str__(self):
+        return f"{self.election.name} {self.minute:%Y-%m-%d %H:%M}: {self.ballots} ballots"
+
+
+# ---------------------- request profiles ----
+class RequestProfile(models.Model):
+    # one request that ran under the sampling profiler (see profiling.py)
+    TRIGGER_CHOICES = [
+        ('staff', 'Asked for by staff'),
+        ('sampled', 'Random sample'),
+    ]
+
+    url_name = models.CharField(max_length=100, db_index=True)
+    path = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    status = models.PositiveSmallIntegerField()
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    started_at = models.DateTimeField(auto_now_add=True)
+
+    duration_ms = models.FloatField()
+    samples = models.PositiveIntegerField()
+    sql_count = models.PositiveIntegerField()
+    sql_ms = models.FloatField()
+
+    # "frame;frame;frame count" lines, the collapsed-stack format flamegraph tools read
+    stacks = models.TextField()
+
+    # the slowest statements: [[milliseconds, sql], ...]
+    queries = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
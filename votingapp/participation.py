@@ -0,0 +1,200 @@
+# ---------------- participation index ----------------
+# "Has this student voted in election X?" and "how many have voted?" answered from one
+# compact bitmap per election instead of the voted_in_elections join table.
+#
+# The bitmap is indexed by student profile pk (the same ordinal the eligibility
+# engine uses, so the two can be AND-ed together directly). cast_ballot_view keeps
+# writing to voted_in_elections exactly like before; the bitmap catches up from that
+# table in batches using a watermark on the join table's auto increment id, so the
+# cast path never fights over the bitmap row.
+#
+# Reading (load) never writes: results pages are GETs and may be on the read replica.
+# The saved bitmap is brought forward by sync(), which runs after casts commit (at most
+# once every SYNC_INTERVAL seconds per election) and from the reconcile_participation command.
+
+import time
+import zlib
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ElectionParticipation, StudentProfile
+from . import writer
+
+
+VOTED_THROUGH = StudentProfile.voted_in_elections.through
+
+
+def _pack(bits):
+    return zlib.compress(bytes(bits), 1)
+
+
+def _unpack(blob):
+    return bytearray(zlib.decompress(bytes(blob))) if blob else bytearray()
+
+
+class ParticipationIndex:
+    """
+    In-memory view of an election's participation bitmap.
+    """
+
+    def __init__(self, bits, voter_count):
+        self.bits = bits
+        self.voter_count = voter_count
+
+    def has_voted(self, profile_id):
+        # O(1): just look at one bit
+        byte_index = profile_id >> 3
+        if byte_index >= len(self.bits):
+            return False
+        return bool(self.bits[byte_index] & (1 << (profile_id & 7)))
+
+    def as_mask(self):
+        # the whole bitmap as one int so it can be combined with eligibility masks
+        return int.from_bytes(self.bits, 'little')
+
+    def non_voters(self, eligible_mask):
+        # eligible students whose bit isn't set yet
+        return eligible_mask & ~self.as_mask()
+
+
+# join table ids are handed out when the row is inserted but only become visible when
+# the transaction commits, so a slow cast can show up *below* ids we've already read.
+# So there are two watermarks: `seen_watermark` is the highest id folded in, and
+# `watermark` only moves up to a seen_watermark once it is SETTLE_SECONDS old. Every row
+# under it had its id handed out before then, and no cast transaction stays open that
+# long, so everything under `watermark` is really in the bitmap. Each read re-scans from
+# `watermark` (setting a bit twice is harmless), which catches any straggler.
+SETTLE_SECONDS = 60
+
+# how often the saved bitmap is brought forward after casts, per election
+SYNC_INTERVAL = 10
+
+
+def _set_bits(bits, profile_ids):
+    # sets the bits and returns how many of them were not set before
+    added = 0
+    for profile_id in profile_ids:
+        byte_index = profile_id >> 3
+        if byte_index >= len(bits):
+            bits.extend(bytes(byte_index + 1 - len(bits)))
+        bit = 1 << (profile_id & 7)
+        if not bits[byte_index] & bit:
+            bits[byte_index] |= bit
+            added += 1
+    return added
+
+
+def _popcount(bits):
+    return int.from_bytes(bits, 'little').bit_count()
+
+
+def _fold(election, bits, since, batch_size):
+    # sets the bits of every join table row above `since`.
+    # returns (bits newly set, highest id read or None)
+    added = 0
+    highest = None
+    cursor = since
+    while True:
+        new_rows = list(
+            VOTED_THROUGH.objects.filter(election_id=election.pk, pk__gt=cursor)
+            .order_by('pk')
+            .values_list('pk', 'studentprofile_id')[:batch_size]
+        )
+        if not new_rows:
+            break
+        added += _set_bits(bits, (profile_id for _, profile_id in new_rows))
+        cursor = highest = new_rows[-1][0]
+        if len(new_rows) < batch_size:
+            break
+    return added, highest
+
+
+def load(election, batch_size=10000):
+    """
+    Returns the up to date ParticipationIndex for an election: the saved bitmap plus
+    any voted_in_elections rows that came in since. Read only.
+    """
+    row = ElectionParticipation.objects.filter(election=election).first()
+    if row is None:
+        bits, voter_count, watermark = bytearray(), 0, 0
+    else:
+        bits, voter_count, watermark = _unpack(row.bitmap), row.voter_count, row.watermark
+
+    added, _ = _fold(election, bits, watermark, batch_size)
+    return ParticipationIndex(bits, voter_count + added)
+
+
+@transaction.atomic
+def sync(election, batch_size=10000):
+    """
+    Folds new voted_in_elections rows into the saved bitmap and moves the watermarks
+    forward (see SETTLE_SECONDS). Returns the voter count.
+    """
+    ElectionParticipation.objects.get_or_create(election=election)
+    row = ElectionParticipation.objects.select_for_update().get(election=election)
+    bits = _unpack(row.bitmap)
+    added, highest = _fold(election, bits, row.watermark, batch_size)
+    now = timezone.now()
+
+    seen = max(row.seen_watermark, highest or 0)
+    if row.seen_at is None or now - row.seen_at >= timedelta(seconds=SETTLE_SECONDS):
+        # everything up to the id we saw back then has settled by now
+        if row.seen_at is not None:
+            row.watermark = row.seen_watermark
+        row.seen_watermark, row.seen_at = seen, now
+    else:
+        row.seen_watermark = seen
+
+    row.bitmap = _pack(bits)
+    row.voter_count += added
+    row.save()
+    return row.voter_count
+
+
+def sync_soon(elections):
+    # called after casts commit. the first one in each SYNC_INTERVAL does the sync,
+    # everyone else carries on; cache.add is atomic so only one of them gets the slot
+    for election in elections:
+        if cache.add(f'votingapp:participation_sync:{election.pk}', time.time(), SYNC_INTERVAL):
+            # a write like any other: on the ballot writer with the sqlite profile (see writer.py)
+            writer.run(sync, election)
+
+
+def turnout(election):
+    # number of students who voted, without counting the join table
+    return load(election).voter_count
+
+
+@transaction.atomic
+def reconcile(election):
+    """
+    Rebuilds the bitmap from scratch out of voted_in_elections. Needed when rows are
+    removed from the join table (e.g. by an admin), which the watermark can't see.
+    Safe to run on a schedule as a safety net. Returns (voter_count before, voter_count after).
+    """
+    ElectionParticipation.objects.get_or_create(election=election)
+    row = ElectionParticipation.objects.select_for_update().get(election=election)
+    before = row.voter_count
+
+    bits = bytearray()
+    highest = 0
+    for pk, profile_id in (
+        VOTED_THROUGH.objects.filter(election_id=election.pk)
+        .values_list('pk', 'studentprofile_id')
+        .iterator(chunk_size=10000)
+    ):
+        _set_bits(bits, (profile_id,))
+        highest = max(highest, pk)
+
+    # casts still in flight may commit under `highest`, so that only counts as seen
+    # for now and the settled watermark stays where it was
+    row.bitmap = _pack(bits)
+    row.voter_count = _popcount(bits)
+    row.watermark = min(row.watermark, highest)
+    row.seen_watermark = highest
+    row.seen_at = timezone.now()
+    row.save()
+    return before, row.voter_count
@@ -0,0 +1,196 @@
+# ---------------- per-request sampling profiler ----------------
+# Lets staff see why one page is slow in production without redeploying. A request is
+# profiled when:
+#   - a staff user asks for it with ?_profile=1 or an "X-Profile: 1" header, or
+#   - it's randomly picked by settings.PROFILE_SAMPLE_RATES, e.g. {'ballot_view': 0.01}
+#
+# While the request runs, a helper thread looks at the request thread's stack every
+# PROFILE_INTERVAL seconds (a statistical profiler: nothing is hooked into every call, so
+# the request itself runs at normal speed), and every SQL statement is timed through
+# connection.execute_wrapper. A sample taken while a statement was running gets that
+# statement as its innermost frame, so slow queries show up in the flamegraph.
+#
+# The result is saved as a RequestProfile in the collapsed-stack format that
+# flamegraph.pl / speedscope read, and listed on the staff page at /profiles/.
+# Requests that aren't profiled only pay for a url lookup and a random() (nothing at all
+# when no sample rates are set and nobody asked).
+
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+from .models import RequestProfile
+from . import writer
+
+
+# limits per request, so a pathological request can't eat memory
+MAX_SAMPLES = 5000
+MAX_QUERIES = 200
+SQL_FRAME_LENGTH = 200
+
+# how many profiles we keep
+KEEP_PROFILES = 500
+
+# the profiler's own pages are never profiled
+IGNORED_URL_NAMES = {'profile_list', 'profile_detail', 'profile_stacks'}
+
+
+def _frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def _clean(sql):
+    # one line, no ';' (it separates frames in the collapsed format)
+    return ' '.join(sql.split()).replace(';', ',')[:SQL_FRAME_LENGTH]
+
+
+class Sampler(threading.Thread):
+    """Samples one thread's stack every `interval` seconds until stop() is called."""
+
+    def __init__(self, thread_id, interval, skip):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        # frames below the profiling middleware (gunicorn, django's handler...) left out
+        self.skip = skip
+        self.stacks = Counter()
+        self.samples = 0
+        self.current_sql = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval) and self.samples < MAX_SAMPLES:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.reverse()
+            stack = stack[self.skip:]
+
+            sql = self.current_sql
+            if sql:
+                stack.append(f'SQL {_clean(sql)}')
+
+            self.stacks[';'.join(stack)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class QueryLog:
+    """execute_wrapper that times every statement and tells the sampler what's running."""
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.sampler.current_sql = sql
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sampler.current_sql = None
+            ms = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.total_ms += ms
+            if len(self.statements) < MAX_QUERIES:
+                self.statements.append((ms, sql))
+
+
+def _trigger(request):
+    # (url name, 'staff' / 'sampled' / None for not profiled)
+    asked = request.GET.get('_profile') == '1' or request.headers.get('X-Profile') == '1'
+    rates = getattr(settings, 'PROFILE_SAMPLE_RATES', {})
+    if not asked and not rates:
+        return None, None
+
+    try:
+        url_name = resolve(request.path_info).url_name
+    except Resolver404:
+        return None, None
+    if url_name in IGNORED_URL_NAMES:
+        return url_name, None
+
+    if asked and request.user.is_authenticated and request.user.is_staff:
+        return url_name, 'staff'
+
+    rate = rates.get(url_name)
+    if rate and random.random() < rate:
+        return url_name, 'sampled'
+    return url_name, None
+
+
+def _prune():
+    # keep the newest KEEP_PROFILES
+    cutoff = RequestProfile.objects.order_by('-started_at').values_list('started_at', flat=True)[KEEP_PROFILES:KEEP_PROFILES + 1]
+    if cutoff:
+        RequestProfile.objects.filter(started_at__lte=cutoff[0]).delete()
+
+
+class ProfilingMiddleware:
+    """Goes after the auth middleware (it needs request.user)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        url_name, trigger = _trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        # everything from here down is what the flamegraph shows
+        skip = 0
+        frame = sys._getframe()
+        while frame is not None:
+            skip += 1
+            frame = frame.f_back
+
+        sampler = Sampler(threading.get_ident(), getattr(settings, 'PROFILE_INTERVAL', 0.005), skip)
+        queries = QueryLog(sampler)
+
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(queries))
+                # ballot writes stay on this thread, so their stack and sql are in the profile
+                stack.enter_context(writer.inline())
+                response = self.get_response(request)
+        finally:
+            sampler.stop()
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        RequestProfile.objects.create(
+            url_name=url_name or '',
+            path=request.path[:255],
+            method=request.method,
+            status=response.status_code,
+            trigger=trigger,
+            duration_ms=duration_ms,
+            samples=sampler.samples,
+            sql_count=queries.count,
+            sql_ms=queries.total_ms,
+            stacks='\n'.join(f'{stack} {count}' for stack, count in sampler.stacks.most_common()),
+            queries=[[round(ms, 2), sql] for ms, sql in sorted(queries.statements, key=lambda q: -q[0])[:50]],
+        )
+        if random.random() < 0.05:
+            _prune()
+
+        response['X-Profile-Duration'] = f'{duration_ms:.1f}ms'
+        return response
@@ -0,0 +1,165 @@
+# ---------------- read replica routing ----------------
+# When REPLICA_DATABASE_URL is set, the heavy read-only pages (results, dashboard and the
+# admin) read the voting tables from the 'replica' database so they don't compete with
+# cast_ballot_view's transactions on the primary.
+#
+# Four things keep that safe:
+#   1. only GET/HEAD requests to the views listed in settings.REPLICA_READ_VIEWS use it
+#   2. after a request that writes (any POST), that session sticks to the primary for
+#      REPLICA_PIN_SECONDS, so people always see their own writes (e.g. their vote)
+#   3. if the replica falls more than REPLICA_MAX_LAG seconds behind (or can't be
+#      reached) everything quietly goes back to the primary
+#   4. the versions (versions.py) always come from the primary, so what was read from a
+#      replica that is a little behind may be older than them. A request that read the
+#      replica (used()) never caches what it built under a version, and its page gets no
+#      ETag. The ballot is built on the primary only, it's cached for good
+#
+# For local testing, point REPLICA_DATABASE_URL at the same sqlite file / postgres db.
+
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+log = logging.getLogger(__name__)
+
+REPLICA = 'replica'
+
+# set per request by ReplicaMiddleware
+_use_replica = ContextVar('use_replica', default=False)
+
+# set by the router once the request has actually read from the replica
+_replica_read = ContextVar('replica_read', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def used():
+    # this request read something from the replica
+    return _replica_read.get()
+
+
+# ---- lag guard ----
+
+_lag_lock = threading.Lock()
+_lag_state = {'checked_at': 0.0, 'healthy': False}
+
+
+def _measure_lag():
+    # seconds the replica is behind the primary (0 for backends we can't ask)
+    connection = connections[REPLICA]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+        )
+        return float(cursor.fetchone()[0] or 0)
+
+
+def replica_healthy():
+    """
+    True if the replica is close enough behind the primary to read from.
+    Only actually checked every REPLICA_LAG_CHECK_INTERVAL seconds per process.
+    """
+    interval = getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5)
+    now = time.monotonic()
+
+    if now - _lag_state['checked_at'] < interval:
+        return _lag_state['healthy']
+
+    with _lag_lock:
+        # someone else may have just checked while we waited for the lock
+        if now - _lag_state['checked_at'] < interval:
+            return _lag_state['healthy']
+        try:
+            lag = _measure_lag()
+            healthy = lag <= getattr(settings, 'REPLICA_MAX_LAG', 2)
+            if not healthy:
+                log.warning(f"Replica is {lag:.1f}s behind, reading from the primary.")
+        except Exception as e:
+            log.error(f"Replica lag check failed, reading from the primary: {e}")
+            healthy = False
+        _lag_state.update(checked_at=now, healthy=healthy)
+        return healthy
+
+
+# ---- the router ----
+
+class ReplicaRouter:
+    """
+    Sends reads of the voting app's tables to the replica while a request is flagged
+    for it. Everything else (sessions, auth, all writes) stays on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            _use_replica.get()
+            and model._meta.app_label == 'votingapp'
+            and replica_healthy()
+        ):
+            _replica_read.set(True)
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both databases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema from replication
+        return db != REPLICA
+
+
+# ---- the middleware ----
+
+class ReplicaMiddleware:
+    """
+    Decides per request whether reads may use the replica, and pins a session to the
+    primary for a while after it writes. Goes after the session/auth middleware.
+    """
+
+    SESSION_KEY = '_primary_pinned_until'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replica_token = _use_replica.set(False)
+        read_token = _replica_read.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_replica.reset(replica_token)
+            _replica_read.reset(read_token)
+
+        # students and staff only change things with POSTs (casting, admin edits, logging in),
+        # so only those pin
+        if replica_configured() and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            pin = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+            if pin and hasattr(request, 'session'):
+                request.session[self.SESSION_KEY] = time.time() + pin
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not replica_configured() or request.method not in ('GET', 'HEAD'):
+            return None
+
+        # recently wrote something: read it back from the primary
+        if request.session.get(self.SESSION_KEY, 0) > time.time():
+            return None
+
+        match = request.resolver_match
+        read_views = getattr(settings, 'REPLICA_READ_VIEWS', ())
+        if match.url_name in read_views or 'admin' in match.namespaces:
+            _use_replica.set(True)
+        return None
@@ -0,0 +1,150 @@
+# ---------------- signal handlers ----------------
+# connected in apps.py (VotingappConfig.ready)
+
+import logging
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Ballot, Candidate, Election, Party, Position, StudentProfile, Vote
+from . import eligibility, images, participation, versions
+
+log = logging.getLogger(__name__)
+
+
+@receiver(m2m_changed, sender=StudentProfile.voted_in_elections.through)
+def voted_in_elections_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        # instance is the election, pk_set the profiles
+        elections = [instance]
+        profile_ids = pk_set or []
+    else:
+        profile_ids = [instance.pk]
+        if pk_set:
+            elections = list(Election.objects.filter(pk__in=pk_set))
+        else:
+            # post_clear from the profile side doesn't tell us which elections were affected
+            elections = list(Election.objects.filter(participation__isnull=False))
+
+    # adds are folded into the saved bitmap shortly after they commit, but removed
+    # rows (e.g. an admin un-ticking an election) mean the bitmap has to be rebuilt
+    if action == 'post_add':
+        transaction.on_commit(lambda: participation.sync_soon(elections), robust=True)
+    else:
+        for election in elections:
+            participation.reconcile(election)
+
+    # results and the students' own pages changed, but only once this is committed
+    def bump():
+        for election in elections:
+            versions.bump_tally(election.pk)
+        for profile_id in profile_ids:
+            versions.bump_voter(profile_id)
+
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=StudentProfile)
+def student_profile_changed(sender, instance, **kwargs):
+    versions.bump_roster()
+
+
+@receiver(post_save, sender=Vote)
+@receiver(post_save, sender=Ballot)
+def votes_changed(sender, instance, **kwargs):
+    # casts are covered by voted_in_elections_changed, this catches edits made in the admin.
+    # No post_delete here: it would make django load and signal every vote row one by one
+    # when a candidate or election is deleted (see votes_deleted and admin.py instead)
+    if sender is Ballot:
+        election_id = instance.election_id
+    else:
+        election_id = Position.objects.filter(pk=instance.position_id).values_list('election_id', flat=True).first()
+    if election_id is not None:
+        transaction.on_commit(lambda: versions.bump_tally(election_id))
+
+
+@receiver(pre_delete, sender=Election)
+@receiver(pre_delete, sender=Position)
+@receiver(pre_delete, sender=Candidate)
+def votes_deleted(sender, instance, **kwargs):
+    # their votes go with them (cascade), so the results change
+    if sender is Election:
+        election_id = instance.pk
+    elif sender is Position:
+        election_id = instance.election_id
+    else:
+        election_id = Position.objects.filter(pk=instance.position_id).values_list('election_id', flat=True).first()
+    if election_id is not None:
+        transaction.on_commit(lambda: versions.bump_tally(election_id))
+
+
+def _generate_image_variants(instance, fields):
+    # resize new uploads once the save has committed (and the file is really in storage).
+    # A re-upload can keep the same name (S3 overwrites files), so every image goes through
+    # generate_variants, which leaves it alone when its content hash hasn't changed
+    def generate():
+        for field in fields:
+            field_file = getattr(instance, field)
+            if not field_file:
+                continue
+            try:
+                images.generate_variants(field_file.name)
+            except Exception as e:
+                # a broken image shouldn't break saving the candidate, the original still shows
+                log.error(f"Could not generate variants for {field_file.name}: {e}")
+
+    transaction.on_commit(generate)
+
+
+@receiver(post_save, sender=Candidate)
+def candidate_image_variants(sender, instance, **kwargs):
+    _generate_image_variants(instance, ('candidate_photo', 'independent_symbol'))
+
+
+@receiver(post_save, sender=Party)
+def party_image_variants(sender, instance, **kwargs):
+    _generate_image_variants(instance, ('logo',))
+
+
+# --- ballot content versions (see versions.py) ---
+# bumped once the admin's change has committed: bumped any earlier, a ballot built in
+# between would read the old rows and be cached (for good) under the new version
+@receiver([post_save, post_delete], sender=Election)
+def election_changed(sender, instance, **kwargs):
+    # read now: a deleted instance has lost its pk by the time the bump runs
+    election_id = instance.pk
+
+    def bump():
+        versions.bump_content(election_id)
+        versions.bump_elections()
+
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=Position)
+def position_changed(sender, instance, **kwargs):
+    election_id = instance.election_id
+
+    def bump():
+        versions.bump_content(election_id)
+        # the limits may have changed, so the eligible counts have to be worked out again
+        eligibility.invalidate(election_id)
+
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=Candidate)
+def candidate_changed(sender, instance, **kwargs):
+    election_id = Position.objects.filter(pk=instance.position_id).values_list('election_id', flat=True).first()
+    if election_id is not None:
+        transaction.on_commit(lambda: versions.bump_content(election_id))
+
+
+@receiver([post_save, post_delete], sender=Party)
+def party_changed(sender, instance, **kwargs):
+    # parties are shared by every election
+    transaction.on_commit(versions.bump_content)
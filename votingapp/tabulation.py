@@ -0,0 +1,191 @@
+# ---------------- tabulation ----------------
+# Works out the winners of a position according to its voting method:
+#
+#   plurality / approval -> the `seats` candidates with the most votes (Vote rows + packed ballots)
+#   irv                  -> instant runoff: eliminate the last candidate until someone has
+#                           more than half of the ballots still in play
+#   stv                  -> single transferable vote with a Droop quota, surpluses passed on
+#                           at a fraction of their value (Gregory method)
+#
+# Ranked ballots are never looked at one by one. The database groups identical rankings
+# (they are identical bytes) so we get "this exact order: N ballots", and every round only
+# walks those groups using flat integer arrays, never per-ballot objects. Results are
+# cached per position until the next vote is cast.
+
+from array import array
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from .ballots import unpack_ranking
+from .models import RankedBallot
+from . import replica, versions
+
+
+def load_groups(position):
+    """
+    Returns (candidate ids, flat preferences, group offsets, group weights) for a ranked
+    position. Group g's preferences are prefs[offsets[g]:offsets[g + 1]], as indexes into
+    the candidate id list, and weights[g] is how many ballots had exactly that ranking.
+    """
+    candidate_ids = list(position.candidates.order_by('pk').values_list('pk', flat=True))
+    index = {candidate_id: i for i, candidate_id in enumerate(candidate_ids)}
+
+    prefs = array('i')
+    offsets = array('i', [0])
+    weights = array('q')
+
+    grouped = (
+        RankedBallot.objects.filter(position=position)
+        .values('ranking')
+        .annotate(n=Count('id'))
+        .values_list('ranking', 'n')
+    )
+    for ranking, n in grouped.iterator():
+        # a candidate removed after the vote simply drops out of the ranking
+        prefs.extend(index[c] for c in unpack_ranking(ranking) if c in index)
+        offsets.append(len(prefs))
+        weights.append(n)
+
+    return candidate_ids, prefs, offsets, weights
+
+
+def _pick_lowest(tally, continuing, history):
+    # the continuing candidate with the fewest votes. Ties go to whoever had fewer votes in
+    # the most recent round where they differed, and then to the later (higher) candidate id
+    def key(c):
+        return (tally[c], [round_tally[c] for round_tally in reversed(history)], -c)
+    return min(continuing, key=key)
+
+
+def count_ranked(candidate_count, prefs, offsets, weights, seats=1, method='stv'):
+    """
+    Runs IRV (method='irv') or STV over grouped rankings.
+    Candidates are the indexes 0..candidate_count-1.
+    Returns (elected indexes in order of election, list of rounds); each round is
+    {'tally': [votes per candidate], 'exhausted': votes, 'elected': [...], 'eliminated': idx or None}.
+    """
+    groups = len(weights)
+    # where each group is in its ranking, and what each group's ballots are still worth
+    pointer = array('i', offsets[:-1]) if groups else array('i')
+    value = array('d', weights)
+
+    continuing = set(range(candidate_count))
+    # same thing as a flag per candidate, quicker to check inside the group loop
+    alive = bytearray([1]) * candidate_count
+    elected = []
+    rounds = []
+    history = []
+
+    total_valid = float(sum(weights))
+    if not total_valid:
+        return elected, rounds
+    quota = int(total_valid // (seats + 1)) + 1
+
+    while len(elected) < seats and continuing:
+
+        # --- 1. move every group on to its best candidate still in the race and count
+        tally = [0.0] * candidate_count
+        exhausted = 0.0
+        for g in range(groups):
+            p = pointer[g]
+            end = offsets[g + 1]
+            while p < end and not alive[prefs[p]]:
+                p += 1
+            pointer[g] = p
+            if p < end:
+                tally[prefs[p]] += value[g]
+            else:
+                exhausted += value[g]
+
+        this_round = {'tally': tally, 'exhausted': exhausted, 'elected': [], 'eliminated': None}
+        rounds.append(this_round)
+        history.append(tally)
+
+        # --- 2. fewer candidates left than seats: they all get in
+        if len(continuing) <= seats - len(elected):
+            winners = sorted(continuing, key=lambda c: -tally[c])
+            elected.extend(winners)
+            this_round['elected'] = winners
+            break
+
+        # irv: a majority of the ballots still in play wins
+        if method == 'irv':
+            active = total_valid - exhausted
+            quota = active / 2
+
+        leader = max(continuing, key=lambda c: (tally[c], -c))
+        reached = tally[leader] > quota if method == 'irv' else tally[leader] >= quota
+
+        if reached and tally[leader] > 0:
+            # --- 3. elect the leader and pass their surplus on at a reduced value
+            elected.append(leader)
+            continuing.discard(leader)
+            alive[leader] = 0
+            this_round['elected'] = [leader]
+
+            if method == 'stv':
+                factor = (tally[leader] - quota) / tally[leader]
+                for g in range(groups):
+                    p = pointer[g]
+                    if p < offsets[g + 1] and prefs[p] == leader:
+                        value[g] *= factor
+        else:
+            # --- 4. nobody made it: drop the last candidate, their ballots move on at full value
+            loser = _pick_lowest(tally, continuing, history[:-1])
+            continuing.discard(loser)
+            alive[loser] = 0
+            this_round['eliminated'] = loser
+
+    return elected, rounds
+
+
+def tabulate_position(position):
+    """
+    Round by round result of a ranked position, with candidate ids instead of indexes:
+    {'winners': [ids], 'ballots': n, 'quota': q, 'rounds': [{'tally': {id: votes}, ...}]}.
+    Cached until the election's tally changes.
+    """
+    tag = versions.version_tag(versions.tally_version(position.election_id))
+    key = f'votingapp:tabulation:{position.pk}:{position.voting_method}:{position.seats}:{tag}'
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    candidate_ids, prefs, offsets, weights = load_groups(position)
+    seats = 1 if position.voting_method == 'irv' else position.seats
+
+    elected, rounds = count_ranked(
+        len(candidate_ids), prefs, offsets, weights, seats=seats, method=position.voting_method
+    )
+
+    ballots = sum(weights)
+    result = {
+        'winners': [candidate_ids[i] for i in elected],
+        'ballots': ballots,
+        'quota': int(ballots // (seats + 1)) + 1 if position.voting_method == 'stv' else None,
+        'rounds': [
+            {
+                'number': number,
+                'tally': {candidate_ids[i]: round(votes, 2) for i, votes in enumerate(r['tally'])},
+                'exhausted': round(r['exhausted'], 2),
+                'elected': [candidate_ids[i] for i in r['elected']],
+                'eliminated': candidate_ids[r['eliminated']] if r['eliminated'] is not None else None,
+            }
+            for number, r in enumerate(rounds, start=1)
+        ],
+    }
+    if not replica.used():
+        cache.set(key, result, 60 * 60 * 24)
+    return result
+
+
+def candidate_rounds(result, candidate_id):
+    # a candidate's votes in each round of a tabulate_position() result, '' once elected or out
+    votes = []
+    still_in = True
+    for r in result['rounds']:
+        votes.append(r['tally'].get(candidate_id, 0) if still_in else '')
+        if candidate_id in r['elected'] or r['eliminated'] == candidate_id:
+            still_in = False
+    return votes
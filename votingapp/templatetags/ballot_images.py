@@ -0,0 +1,29 @@
+from django import template
+from django.utils.html import format_html
+
+from votingapp.images import variant_srcsets
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_img(field_file, alt='', css_class='', sizes='100vw'):
+    """
+    Renders an uploaded image as a <picture> with the WebP and JPEG variants in srcset.
+    Falls back to a plain <img> of the original when no variants exist yet.
+
+    usage: {% responsive_img candidate.candidate_photo alt=candidate.name css_class="candidate-photo" sizes="80px" %}
+    """
+    srcsets = variant_srcsets(field_file)
+
+    if srcsets is None:
+        return format_html('<img src="{}" alt="{}" class="{}">', field_file.url, alt, css_class)
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        srcsets['webp'], sizes,
+        srcsets['src'], srcsets['jpg'], sizes, alt, css_class,
+    )
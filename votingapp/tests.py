@@ -1,3 +1,845 @@
-from django.test import TestCase
+import contextvars
+import shutil
+import tempfile
+from array import array
+from datetime import timedelta
+from io import BytesIO
 
-# Create your tests here.
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.db.models import QuerySet
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .ballots import candidates_with_votes, parse_submission, record_ballot, validate_ballot
+from .cache_backends import WriterDatabaseCache
+from .models import Ballot, Candidate, CastToken, Election, ElectionParticipation, ImageDerivative, KioskBatch, PollingStation, Position, StudentProfile, TurnoutMinute, Vote
+from .tabulation import count_ranked, tabulate_position
+from . import ballots, eligibility, idempotency, images, kiosk, participation, replica, turnout, versions, views, warmup, writer
+
+
+def groups(*rankings):
+    # [(ranking as candidate indexes, number of ballots), ...] -> what count_ranked takes
+    prefs = array('i')
+    offsets = array('i', [0])
+    weights = array('q')
+    for ranking, n in rankings:
+        prefs.extend(ranking)
+        offsets.append(len(prefs))
+        weights.append(n)
+    return prefs, offsets, weights
+
+
+def make_election(**positions):
+    # positions={'name': (voting_method, seats, [candidate names])}
+    now = timezone.now()
+    election = Election.objects.create(
+        name='Test', start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1)
+    )
+    made = {}
+    for name, (method, seats, candidates) in positions.items():
+        position = Position.objects.create(election=election, name=name, voting_method=method, seats=seats)
+        made[name] = (position, [Candidate.objects.create(position=position, name=c) for c in candidates])
+    return election, made
+
+
+def make_students(n, prefix='s'):
+    User = get_user_model()
+    return [
+        StudentProfile.objects.create(user=User.objects.create(username=f'{prefix}{i}'), student_id=f'{prefix.upper()}{i:05d}')
+        for i in range(n)
+    ]
+
+
+# ---------- counting ----------
+
+class InstantRunoffTests(TestCase):
+
+    def test_tennessee_capital(self):
+        # the textbook example: Memphis leads the first round but Knoxville wins
+        memphis, nashville, chattanooga, knoxville = range(4)
+        elected, rounds = count_ranked(4, *groups(
+            ([memphis, nashville, chattanooga, knoxville], 42),
+            ([nashville, chattanooga, knoxville, memphis], 26),
+            ([chattanooga, knoxville, nashville, memphis], 15),
+            ([knoxville, chattanooga, nashville, memphis], 17),
+        ), seats=1, method='irv')
+
+        self.assertEqual(elected, [knoxville])
+        self.assertEqual([r['eliminated'] for r in rounds], [chattanooga, nashville, None])
+        self.assertEqual(rounds[0]['tally'], [42, 26, 15, 17])
+        self.assertEqual(rounds[1]['tally'], [42, 26, 0, 32])
+        self.assertEqual(rounds[2]['tally'], [42, 0, 0, 58])
+
+    def test_majority_of_ballots_still_in_play(self):
+        # the bullet votes for C run out, A then has 4 of the 7 ballots left
+        a, b, c = range(3)
+        elected, rounds = count_ranked(3, *groups(([a], 4), ([b], 3), ([c], 2)), seats=1, method='irv')
+
+        self.assertEqual(elected, [a])
+        self.assertEqual(rounds[0]['eliminated'], c)
+        self.assertEqual(rounds[1]['exhausted'], 2)
+
+    def test_tie_for_last_goes_to_the_higher_candidate(self):
+        a, b, c = range(3)
+        elected, rounds = count_ranked(3, *groups(([a], 3), ([b], 2), ([c], 2)), seats=1, method='irv')
+
+        self.assertEqual(rounds[0]['eliminated'], c)
+        self.assertEqual(elected, [a])
+
+    def test_tie_for_last_looks_at_earlier_rounds(self):
+        # B and C are level in round 2, but B had fewer votes in round 1 so B goes,
+        # even though the candidate order alone would drop C
+        a, b, c, d = range(4)
+        elected, rounds = count_ranked(4, *groups(
+            ([a], 5), ([b], 2), ([c], 3), ([d, b], 1),
+        ), seats=1, method='irv')
+
+        self.assertEqual(rounds[1]['tally'][b], rounds[1]['tally'][c])
+        self.assertEqual([r['eliminated'] for r in rounds[:2]], [d, b])
+        self.assertEqual(elected, [a])
+
+    def test_no_ballots(self):
+        self.assertEqual(count_ranked(3, *groups(), seats=1, method='irv'), ([], []))
+
+
+class SingleTransferableVoteTests(TestCase):
+
+    def test_surplus_transfer(self):
+        # the usual food election: 20 ballots, 3 seats, Droop quota 6
+        oranges, pears, chocolate, strawberries, hamburgers = range(5)
+        elected, rounds = count_ranked(5, *groups(
+            ([oranges], 4),
+            ([pears, oranges], 2),
+            ([chocolate, strawberries], 8),
+            ([chocolate, hamburgers], 4),
+            ([strawberries], 1),
+            ([hamburgers], 1),
+        ), seats=3, method='stv')
+
+        self.assertEqual(elected, [chocolate, oranges, strawberries])
+        self.assertEqual(rounds[0]['elected'], [chocolate])
+        # chocolate's 6 surplus votes out of 12 go on at half value
+        self.assertEqual(rounds[1]['tally'][strawberries], 5)
+        self.assertEqual(rounds[1]['tally'][hamburgers], 3)
+        self.assertEqual(rounds[1]['eliminated'], pears)
+        self.assertEqual(rounds[2]['elected'], [oranges])
+        self.assertEqual(rounds[3]['eliminated'], hamburgers)
+        # the hamburger ballots have nowhere left to go
+        self.assertEqual(rounds[4]['exhausted'], 3)
+
+    def test_fewer_candidates_than_seats(self):
+        a, b = range(2)
+        elected, _ = count_ranked(2, *groups(([a], 1), ([b], 5)), seats=3, method='stv')
+        self.assertEqual(elected, [b, a])
+
+
+class TabulatePositionTests(TestCase):
+
+    def test_counts_stored_rankings(self):
+        election, made = make_election(Mayor=('irv', 1, ['Memphis', 'Nashville', 'Chattanooga', 'Knoxville']))
+        position, (memphis, nashville, chattanooga, knoxville) = made['Mayor']
+        for ranking, n in (
+            ([memphis, nashville, chattanooga, knoxville], 42),
+            ([nashville, chattanooga, knoxville, memphis], 26),
+            ([chattanooga, knoxville, nashville, memphis], 15),
+            ([knoxville, chattanooga, nashville, memphis], 17),
+        ):
+            for _ in range(n):
+                record_ballot(election, [], {position.pk: [c.pk for c in ranking]})
+
+        result = tabulate_position(position)
+        self.assertEqual(result['winners'], [knoxville.pk])
+        self.assertEqual(result['ballots'], 100)
+        self.assertEqual(result['rounds'][-1]['tally'][knoxville.pk], 58)
+
+
+# ---------- reading and checking ranked ballots ----------
+
+class ParseSubmissionTests(TestCase):
+
+    def parse(self, query):
+        return parse_submission(QueryDict(query))
+
+    def test_ranking_in_order(self):
+        pairs, rankings = self.parse('7=3&rank-5-11=2&rank-5-10=1&rank-5-12=')
+        self.assertEqual(pairs, [(7, 3)])
+        self.assertEqual(rankings, {5: [10, 11]})
+
+    def test_rejects_malformed_rankings(self):
+        for query in (
+            'rank-5-10=1&rank-5-11=3',   # gap
+            'rank-5-10=1&rank-5-11=1',   # repeat
+            'rank-5-10=2',               # doesn't start at 1
+            'rank-5-10=first',           # not a number
+            'rank-5=1',                  # no candidate
+            'rank-5-x=1',                # candidate isn't a number
+            '7=abc',                     # plain choice isn't a number
+        ):
+            with self.subTest(query=query), self.assertRaises(ValueError):
+                self.parse(query)
+
+
+class ValidateBallotTests(TestCase):
+
+    def setUp(self):
+        self.election, made = make_election(
+            President=('plurality', 1, ['P1', 'P2']),
+            Council=('stv', 2, ['C1', 'C2', 'C3']),
+        )
+        self.president, (self.p1, self.p2) = made['President']
+        self.council, (self.c1, self.c2, self.c3) = made['Council']
+
+    def test_valid_ballot(self):
+        validate_ballot(
+            self.election, [(self.president.pk, self.p1.pk)], {self.council.pk: [self.c2.pk, self.c1.pk]}
+        )
+
+    def test_rejects_bad_rankings(self):
+        for pairs, rankings in (
+            # a candidate from another position
+            ([], {self.council.pk: [self.c1.pk, self.p1.pk]}),
+            # ranking a single choice position
+            ([], {self.president.pk: [self.p1.pk, self.p2.pk]}),
+            # a plain choice on a ranked position
+            ([(self.council.pk, self.c1.pk)], {}),
+            # the same candidate twice
+            ([], {self.council.pk: [self.c1.pk, self.c1.pk]}),
+            # a candidate that doesn't exist
+            ([], {self.council.pk: [self.c1.pk, 999999]}),
+        ):
+            with self.subTest(pairs=pairs, rankings=rankings), self.assertRaises(ValueError):
+                validate_ballot(self.election, pairs, rankings)
+
+
+# ---------- participation bitmap ----------
+
+class ParticipationTests(TestCase):
+
+    def setUp(self):
+        self.election, _ = make_election()
+        self.students = make_students(5)
+        self.through = StudentProfile.voted_in_elections.through
+
+    def vote(self, student, pk=None):
+        # a join table row, optionally with a chosen id to play out commits arriving out of order
+        return self.through.objects.create(pk=pk, studentprofile=student, election=self.election)
+
+    def settle(self):
+        # pretend SETTLE_SECONDS went by since the last sync
+        ElectionParticipation.objects.filter(election=self.election).update(
+            seen_at=timezone.now() - timedelta(seconds=participation.SETTLE_SECONDS + 1)
+        )
+
+    def test_load_sees_new_votes_without_writing(self):
+        self.vote(self.students[0])
+        with CaptureQueriesContext(connection) as queries:
+            index = participation.load(self.election)
+        self.assertTrue(all(q['sql'].startswith('SELECT') for q in queries.captured_queries))
+        self.assertTrue(index.has_voted(self.students[0].pk))
+        self.assertFalse(index.has_voted(self.students[1].pk))
+        self.assertEqual(index.voter_count, 1)
+        self.assertFalse(ElectionParticipation.objects.exists())
+
+    def test_late_commit_below_seen_rows_is_counted(self):
+        first = self.vote(self.students[0])
+        participation.sync(self.election)
+        self.settle()
+        participation.sync(self.election)
+        self.vote(self.students[1], pk=first.pk + 10)
+        participation.sync(self.election)
+
+        # a cast that got its id earlier but only commits now
+        self.vote(self.students[2], pk=first.pk + 5)
+        self.assertTrue(participation.load(self.election).has_voted(self.students[2].pk))
+        self.assertEqual(participation.sync(self.election), 3)
+
+        row = ElectionParticipation.objects.get(election=self.election)
+        self.assertEqual(row.watermark, first.pk)
+        self.settle()
+        participation.sync(self.election)
+        row.refresh_from_db()
+        self.assertEqual(row.watermark, first.pk + 10)
+        self.assertEqual(row.voter_count, 3)
+
+    def test_reconcile_after_removal(self):
+        for student in self.students[:3]:
+            self.vote(student)
+        participation.sync(self.election)
+        self.students[0].voted_in_elections.remove(self.election)
+
+        self.assertEqual(participation.turnout(self.election), 2)
+        self.assertFalse(participation.load(self.election).has_voted(self.students[0].pk))
+
+    def test_casts_sync_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.students[0].voted_in_elections.add(self.election)
+        self.assertEqual(ElectionParticipation.objects.get(election=self.election).voter_count, 1)
+
+
+# ---------- the ballot json ----------
+
+class BallotApiTests(TestCase):
+
+    def setUp(self):
+        self.election, made = make_election(President=('plurality', 1, ['P1', 'P2']))
+        self.position, _ = made['President']
+
+    def url(self, **params):
+        return f'/api/ballot/{self.election.pk}/-.-.-/', params
+
+    def test_immutable_only_for_the_current_version(self):
+        self.client.force_login(make_students(1)[0].user)
+        current = versions.version_tag(versions.content_version(self.election.pk))
+
+        response = self.client.get(*self.url(v=current))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertTrue(response.has_header('ETag'))
+
+        for params in ({}, {'v': 'old'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(*self.url(**params))['Cache-Control'], 'public, no-cache')
+
+    def test_not_served_outside_the_voting_window(self):
+        self.client.force_login(make_students(1)[0].user)
+        response = self.client.get(*self.url())
+        etag = response['ETag']
+
+        now = timezone.now()
+        for start, end in ((now - timedelta(hours=2), now - timedelta(hours=1)),
+                           (now + timedelta(hours=1), now + timedelta(hours=2))):
+            # update() skips the signals, so move the schedule on by hand
+            Election.objects.filter(pk=self.election.pk).update(start_time=start, end_time=end)
+            versions.bump_elections()
+            with self.subTest(start=start):
+                # not even a 304 for a browser that still has the old copy
+                response = self.client.get(*self.url(), HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 404)
+                self.assertFalse(response.has_header('ETag'))
+
+    def test_content_version_moves_only_on_commit(self):
+        # a ballot built before the commit must not be cached under the new version
+        before = versions.content_version(self.election.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Candidate.objects.create(position=self.position, name='P3')
+            self.assertEqual(versions.content_version(self.election.pk), before)
+        self.assertGreater(versions.content_version(self.election.pk), before)
+
+
+# ---------- results versions ----------
+
+class TallyVersionTests(TestCase):
+
+    def setUp(self):
+        self.election, made = make_election(President=('plurality', 1, ['P1', 'P2']))
+        self.position, (self.p1, self.p2) = made['President']
+        Vote.objects.bulk_create(Vote(position=self.position, candidate=self.p1) for _ in range(200))
+
+    def test_deleting_a_candidate_doesnt_load_its_votes(self):
+        before = versions.tally_version(self.election.pk)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.p1.delete()
+
+        self.assertLess(len(queries), 20)
+        self.assertFalse(Vote.objects.exists())
+        self.assertGreater(versions.tally_version(self.election.pk), before)
+
+    def test_deleting_votes_in_the_admin(self):
+        before = versions.tally_version(self.election.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.site._registry[Vote].delete_queryset(None, Vote.objects.filter(candidate=self.p1))
+        self.assertGreater(versions.tally_version(self.election.pk), before)
+
+
+# ---------- image variants ----------
+
+class ImageVariantTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(self.settings(MEDIA_ROOT=media))
+        _, made = make_election(President=('plurality', 1, []))
+        self.position, _ = made['President']
+
+    def upload(self, name, color):
+        # overwrites like S3 does, keeping the name
+        from PIL import Image
+
+        out = BytesIO()
+        Image.new('RGB', (400, 200), color).save(out, 'PNG')
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        return default_storage.save(name, ContentFile(out.getvalue()))
+
+    def test_reupload_under_the_same_name(self):
+        name = self.upload('candidate_photos/jane.png', 'red')
+        with self.captureOnCommitCallbacks(execute=True):
+            candidate = Candidate.objects.create(position=self.position, name='Jane', candidate_photo=name)
+        first = ImageDerivative.objects.get(source=name).content_hash
+
+        self.assertEqual(self.upload(name, 'blue'), name)
+        with self.captureOnCommitCallbacks(execute=True):
+            candidate.save()
+        self.assertNotEqual(ImageDerivative.objects.get(source=name).content_hash, first)
+        self.assertTrue(default_storage.exists(images.variant_name(name, 320, 'webp')))
+
+    def test_warmup_caches_under_the_version_after_the_images(self):
+        # the photo's variants haven't been made yet (no commit), the warmup makes them
+        Candidate.objects.create(position=self.position, name='Jane', candidate_photo=self.upload('candidate_photos/jane.png', 'red'))
+        election = self.position.election
+        warmup.warm_election(election)
+
+        with CaptureQueriesContext(connection) as queries:
+            ballots._candidate_positions(election)
+        self.assertFalse([q for q in queries.captured_queries if 'votingapp_candidate' in q['sql']])
+
+
+# ---------- packed ballots ----------
+
+@override_settings(VOTE_STORAGE_MODE='packed')
+class PackedBallotTests(TestCase):
+
+    def setUp(self):
+        self.election, made = make_election(
+            President=('plurality', 1, ['P1', 'P2']),
+            Committee=('approval', 2, ['C1', 'C2', 'C3']),
+        )
+        self.president, (self.p1, self.p2) = made['President']
+        self.committee, (self.c1, self.c2, self.c3) = made['Committee']
+
+    def counts(self):
+        return {candidate.name: candidate.vote_count for candidate in candidates_with_votes(self.election)}
+
+    def test_stored_as_one_row(self):
+        record_ballot(self.election, [(self.president.pk, self.p1.pk), (self.committee.pk, self.c1.pk), (self.committee.pk, self.c3.pk)])
+        self.assertEqual(Ballot.objects.count(), 1)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_validated_like_rows(self):
+        for pairs in (
+            [(self.president.pk, self.p1.pk), (self.president.pk, self.p2.pk)],
+            [(self.committee.pk, self.p1.pk)],
+        ):
+            with self.subTest(pairs=pairs), self.assertRaises(ValueError):
+                record_ballot(self.election, pairs)
+        self.assertFalse(Ballot.objects.exists())
+
+    def test_counted_with_vote_rows(self):
+        # one voter from before the switch to packed storage
+        with override_settings(VOTE_STORAGE_MODE='rows'):
+            record_ballot(self.election, [(self.president.pk, self.p2.pk), (self.committee.pk, self.c2.pk)])
+        for _ in range(2):
+            record_ballot(self.election, [(self.president.pk, self.p1.pk), (self.committee.pk, self.c1.pk), (self.committee.pk, self.c2.pk)])
+
+        self.assertEqual(self.counts(), {'P1': 2, 'P2': 1, 'C2': 3, 'C1': 2, 'C3': 0})
+        self.assertEqual(
+            [candidate.name for candidate in candidates_with_votes(self.election)],
+            ['P1', 'P2', 'C2', 'C1', 'C3'],
+        )
+
+    def test_tally_cached_until_the_next_cast(self):
+        record_ballot(self.election, [(self.president.pk, self.p1.pk)])
+        self.counts()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.counts()
+        self.assertFalse([q for q in queries.captured_queries if 'votingapp_ballot' in q['sql']])
+
+        record_ballot(self.election, [(self.president.pk, self.p2.pk)])
+        versions.bump_tally(self.election.pk)
+        self.assertEqual(self.counts()['P2'], 1)
+
+
+# ---------- eligibility ----------
+
+class EligibilityTests(TestCase):
+
+    def setUp(self):
+        self.election, made = make_election(
+            Guild=('plurality', 1, []),
+            Women=('plurality', 1, []),
+            Weekend=('plurality', 1, []),
+        )
+        self.guild, self.women, self.weekend = (made[name][0] for name in ('Guild', 'Women', 'Weekend'))
+        Position.objects.filter(pk=self.women.pk).update(limit_by_gender='Female')
+        Position.objects.filter(pk=self.weekend.pk).update(limit_by_sponsorship='Government', limit_by_session='Weekend')
+
+        self.students = make_students(5)
+        for student, (gender, sponsorship, session) in zip(self.students, (
+            ('Female', 'Government', 'Weekend'),
+            ('Female', 'Private', 'Weekend'),
+            ('Male', 'Government', 'Weekend'),
+            ('Male', 'Government', 'Weekday'),
+            ('Female', 'Government', 'Weekend'),        # not eligible at all, see below
+        )):
+            student.gender, student.sponsorship_type, student.session_category = gender, sponsorship, session
+            student.is_eligible = student is not self.students[4]
+            student.save()
+
+    def ids(self, *indexes):
+        return sorted(self.students[i].pk for i in indexes)
+
+    def test_eligible_counts(self):
+        self.assertEqual(eligibility.eligible_counts(self.election), {
+            self.guild.pk: 4,
+            self.women.pk: 2,
+            self.weekend.pk: 2,
+        })
+
+    def test_non_voters(self):
+        self.students[0].voted_in_elections.add(self.election)
+        self.students[3].voted_in_elections.add(self.election)
+
+        self.assertEqual(eligibility.eligible_non_voter_ids(self.election), self.ids(1, 2))
+        self.assertEqual(eligibility.eligible_non_voter_ids(self.election, self.women.pk), self.ids(1))
+        self.assertEqual(eligibility.eligible_non_voter_ids(self.election, self.weekend.pk), self.ids(2))
+
+    def test_roster_change_is_picked_up(self):
+        eligibility.eligible_counts(self.election)
+        self.students[4].is_eligible = True
+        self.students[4].save()
+        self.assertEqual(eligibility.eligible_counts(self.election)[self.women.pk], 3)
+
+
+# ---------- conditional pages ----------
+
+class ConditionalPageTests(TestCase):
+
+    def setUp(self):
+        self.election, made = make_election(President=('plurality', 1, ['P1', 'P2']))
+        self.position, (self.p1, _) = made['President']
+        self.student = make_students(1)[0]
+        self.client.force_login(self.student.user)
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def cast(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/cast-vote/{self.election.pk}/', {str(self.position.pk): self.p1.pk})
+
+    def test_unchanged_page(self):
+        etag = self.etag('/elections/')
+        self.assertEqual(self.client.get('/elections/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_changed_after_a_cast(self):
+        staff = self.client_class()
+        staff.force_login(get_user_model().objects.create(username='staff', is_staff=True))
+        results_url = f'/results/{self.election.pk}/'
+        results_etag = staff.get(results_url)['ETag']
+        list_etag = self.etag('/elections/')
+
+        self.assertRedirects(self.cast(), '/thank-you/')
+        # the tally for the results, the student's own version for their list
+        self.assertEqual(staff.get(results_url, HTTP_IF_NONE_MATCH=results_etag).status_code, 200)
+        self.assertEqual(self.client.get('/elections/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_not_while_a_message_is_waiting(self):
+        etag = self.etag('/elections/')
+        # an empty ballot: nothing changes but there's an error to show
+        self.client.post(f'/cast-vote/{self.election.pk}/', {})
+
+        response = self.client.get('/elections/', HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Empty ballot submission')
+        self.assertEqual(self.client.get('/elections/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_not_once_the_election_closes(self):
+        url = f'/ballot/{self.election.pk}/'
+        self.client.get(url)                    # sets the csrf cookie the page's etag needs
+        etag = self.etag(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Election.objects.filter(pk=self.election.pk).update(end_time=timezone.now() - timedelta(minutes=1))
+        versions.bump_elections()
+        # the view turns it away rather than a 304 for the open ballot
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+# ---------- read replica ----------
+
+class ReplicaTests(TestCase):
+
+    def setUp(self):
+        self.election, _ = make_election(Guild=('plurality', 1, ['A', 'B']))
+        self.client.force_login(get_user_model().objects.create(username='staff', is_staff=True))
+
+    def test_router_notes_a_replica_read(self):
+        def read():
+            replica._use_replica.set(True)
+            with mock.patch.object(replica, 'replica_healthy', return_value=True):
+                db = replica.ReplicaRouter().db_for_read(Vote)
+            return db, replica.used()
+
+        self.assertEqual(contextvars.copy_context().run(read), ('replica', True))
+        self.assertFalse(replica.used())
+
+    def test_results_read_from_the_replica_are_not_pinned(self):
+        url = f'/results/{self.election.pk}/'
+        self.assertTrue(self.client.get(url).has_header('ETag'))
+        cache.clear()
+
+        with mock.patch.object(replica, 'used', return_value=True):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertIsNone(cache.get(eligibility._cache_key(self.election.pk)))
+
+
+# ---------- the cache on sqlite ----------
+
+class WriterDatabaseCacheTests(TestCase):
+
+    def test_writes_go_through_the_writer(self):
+        backend = WriterDatabaseCache('votingapp_cache', {})
+        ran = []
+
+        def run(func, *args, **kwargs):
+            ran.append(func.__name__)
+            return func(*args, **kwargs)
+
+        with mock.patch.object(writer, 'run', side_effect=run):
+            backend.set('a', 1)
+            self.assertTrue(backend.add('b', 2))
+            self.assertEqual(backend.get('a'), 1)
+            backend.delete('a')
+            backend.clear()
+
+        self.assertEqual(ran[:2], ['_base_set', '_base_set'])
+        self.assertEqual(ran[-2:], ['_base_delete_many', 'clear'])
+        self.assertIsNone(backend.get('b'))
+
+
+# ---------- turnout per minute ----------
+
+class TurnoutTests(TestCase):
+
+    def setUp(self):
+        self.election, _ = make_election()
+        self.start = turnout.minute_of(timezone.now())
+
+    def rows(self):
+        return list(TurnoutMinute.objects.order_by('minute').values_list('minute', 'ballots', 'votes'))
+
+    def test_record_cast(self):
+        turnout.record_cast(self.election.pk, 3, when=self.start + timedelta(seconds=5))
+        turnout.record_cast(self.election.pk, 2, when=self.start + timedelta(seconds=50))
+        turnout.record_cast(self.election.pk, 1, when=self.start + timedelta(seconds=61))
+        self.assertEqual(self.rows(), [(self.start, 2, 5), (self.start + timedelta(minutes=1), 1, 1)])
+
+    def test_record_cast_when_another_worker_made_the_row(self):
+        TurnoutMinute.objects.create(election=self.election, minute=self.start, ballots=1, votes=1)
+        real_update = QuerySet.update
+        calls = []
+
+        def update(queryset, **kwargs):
+            # the first update ran before the other worker's insert committed
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update):
+            turnout.record_cast(self.election.pk, 4, when=self.start)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.rows(), [(self.start, 2, 5)])
+
+    def test_series_fills_quiet_minutes(self):
+        turnout.record_cast(self.election.pk, 1, when=self.start)
+        turnout.record_cast(self.election.pk, 2, when=self.start + timedelta(minutes=3))
+
+        self.assertEqual(turnout.series(self.election), [
+            (self.start, 1, 1),
+            (self.start + timedelta(minutes=1), 0, 0),
+            (self.start + timedelta(minutes=2), 0, 0),
+            (self.start + timedelta(minutes=3), 1, 2),
+        ])
+        self.assertEqual(turnout.series(make_election()[0]), [])
+
+    def test_capacity(self):
+        minutes = [(self.start + timedelta(minutes=i), n, n) for i, n in enumerate((60, 120, 0, 30))]
+        figures = turnout.capacity(minutes, cast_ms=500)
+
+        self.assertEqual(figures['ballots'], 210)
+        self.assertEqual(figures['busiest_minute'], self.start + timedelta(minutes=1))
+        self.assertEqual(figures['peak_per_sec'], 2.0)
+        # nearest rank over 0, 30, 60, 120 ballots a minute
+        self.assertEqual(figures['percentiles_per_sec'], {50: 0.5, 90: 2.0, 95: 2.0, 99: 2.0})
+        # 2 ballots/s x 0.5 s x 2 headroom
+        self.assertEqual(figures['workers_needed'], 2)
+        self.assertIsNone(turnout.capacity([]))
+
+
+# ---------- offline polling stations ----------
+
+class KioskTests(TestCase):
+
+    def setUp(self):
+        self.election, made = make_election(President=('plurality', 1, ['P1', 'P2']))
+        self.position, (self.p1, self.p2) = made['President']
+        self.students = make_students(3)
+        self.station = PollingStation.objects.create(name='Library')
+
+    def batch(self, entries, batch_id='b1'):
+        return {'batch_id': batch_id, 'election_id': self.election.pk, 'entries': entries}
+
+    def entry(self, student, candidate):
+        return {'student_id': student.student_id, 'choices': [[self.position.pk, candidate.pk]]}
+
+    def test_ingest(self):
+        self.students[1].voted_in_elections.add(self.election)
+        record, created = kiosk.ingest_batch(self.station, self.election, self.batch([
+            self.entry(self.students[0], self.p1),
+            self.entry(self.students[1], self.p1),                      # voted online already
+            self.entry(self.students[0], self.p2),                      # second ballot in the batch
+            {'student_id': 'nobody', 'choices': [[self.position.pk, self.p1.pk]]},
+            {'student_id': self.students[2].student_id, 'choices': [['x', 'y']]},
+        ]))
+
+        self.assertTrue(created)
+        self.assertEqual((record.ingested, record.already_voted, record.rejected), (1, 2, 2))
+        self.assertEqual(Vote.objects.filter(candidate=self.p1).count(), 1)
+        self.assertTrue(self.students[0].voted_in_elections.filter(pk=self.election.pk).exists())
+
+    def test_ballots_are_not_saved_in_entry_order(self):
+        with mock.patch.object(kiosk.random.SystemRandom, 'shuffle', side_effect=lambda rows: rows.reverse()) as shuffle:
+            kiosk.ingest_batch(self.station, self.election, self.batch([
+                self.entry(self.students[0], self.p1),
+                self.entry(self.students[1], self.p2),
+            ]))
+
+        self.assertEqual(shuffle.call_count, 3)
+        self.assertEqual(list(Vote.objects.order_by('pk').values_list('candidate', flat=True)), [self.p2.pk, self.p1.pk])
+
+    def test_same_batch_twice(self):
+        batch = self.batch([self.entry(self.students[0], self.p1)])
+        first, _ = kiosk.ingest_batch(self.station, self.election, batch)
+        again, created = kiosk.ingest_batch(self.station, self.election, batch)
+
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_same_batch_at_the_same_time(self):
+        batch = self.batch([self.entry(self.students[0], self.p1)])
+        kiosk.ingest_batch(self.station, self.election, batch)
+
+        # the second upload can't get its batch record in, so nothing of it is saved...
+        with self.assertRaises(IntegrityError):
+            kiosk._ingest(self.station, self.election, 'b1', [self.entry(self.students[1], self.p1)])
+        self.assertEqual(Vote.objects.count(), 1)
+
+        # ...and it is reported as already uploaded
+        with mock.patch.object(kiosk.KioskBatch.objects, 'filter', side_effect=[KioskBatch.objects.none(), KioskBatch.objects.all()]):
+            record, created = kiosk.ingest_batch(self.station, self.election, batch)
+        self.assertFalse(created)
+        self.assertEqual(record.batch_id, 'b1')
+
+    def test_malformed_batches(self):
+        for batch in (
+            ['not', 'a', 'batch'],
+            {'batch_id': 'b1', 'election_id': self.election.pk},
+            self.batch(['S00000']),
+            self.batch([{'choices': []}]),
+            self.batch([{'student_id': 'S00000', 'choices': [self.p1.pk]}]),
+            self.batch([{'student_id': 'S00000', 'rankings': [self.p1.pk]}]),
+            self.batch([{'student_id': 'S00000', 'rankings': {str(self.position.pk): self.p1.pk}}]),
+        ):
+            with self.subTest(batch=batch), self.assertRaises(ValueError):
+                kiosk.ingest_batch(self.station, self.election, batch)
+        self.assertFalse(KioskBatch.objects.exists())
+
+    def test_upload_reports_a_malformed_batch(self):
+        staff = get_user_model().objects.create(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        token = kiosk.sign_batch(self.station, self.batch(['S00000']))
+
+        response = self.client.post(
+            f'/kiosk/{self.election.pk}/upload/',
+            {'station': self.station.pk, 'batch': SimpleUploadedFile('batch.txt', token.encode())},
+            follow=True,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'The batch was not counted: Entry 1 is not a ballot')
+
+
+# ---------- casting the same form twice ----------
+
+class IdempotentCastTests(TestCase):
+
+    def setUp(self):
+        self.election, made = make_election(President=('plurality', 1, ['P1', 'P2']))
+        self.position, (self.p1, self.p2) = made['President']
+        self.student = make_students(1)[0]
+        self.client.force_login(self.student.user)
+        self.url = f'/cast-vote/{self.election.pk}/'
+
+    def form(self, token, candidate=None):
+        return {str(self.position.pk): (candidate or self.p1).pk, 'ballot_token': token}
+
+    def test_resent_form_is_counted_once(self):
+        token = idempotency.new_token()
+        for _ in range(2):
+            response = self.client.post(self.url, self.form(token))
+            self.assertRedirects(response, '/thank-you/')
+
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(CastToken.objects.get().token, token)
+
+    def test_resent_while_the_first_is_still_casting(self):
+        token = idempotency.new_token()
+        self.assertTrue(idempotency.claim(self.student.user.pk, self.election.pk, token))
+
+        # answered straight away, not after the first copy
+        response = self.client.post(self.url, self.form(token))
+        status_url = f'/cast-vote/{self.election.pk}/status/{token}/'
+        self.assertRedirects(response, status_url)
+        self.assertContains(self.client.get(status_url), 'Your vote is being recorded')
+        self.assertFalse(Vote.objects.exists())
+
+        # the first copy commits
+        views._store_cast(self.student.user, self.election.pk, QueryDict(f'{self.position.pk}={self.p1.pk}'), token)
+        self.assertRedirects(self.client.get(status_url), '/thank-you/')
+
+    def test_failed_cast_frees_the_token(self):
+        token = idempotency.new_token()
+        response = self.client.post(self.url, {'ballot_token': token}, follow=True)
+        self.assertContains(response, 'Empty ballot submission')
+        self.assertFalse(CastToken.objects.exists())
+
+        self.assertRedirects(self.client.post(self.url, self.form(token)), '/thank-you/')
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_two_copies_that_both_got_in(self):
+        # the cache let both through: the vote tables still stop the second copy, which
+        # recognises its own token, while another form is turned away
+        token = idempotency.new_token()
+        post = QueryDict(f'{self.position.pk}={self.p1.pk}')
+        self.assertEqual(views._store_cast(self.student.user, self.election.pk, post, token), 'counted')
+        self.assertEqual(views._store_cast(self.student.user, self.election.pk, post, token), 'counted')
+        self.assertEqual(views._store_cast(self.student.user, self.election.pk, post, idempotency.new_token()), 'already_voted')
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_already_voted_releases_the_claim(self):
+        self.client.post(self.url, self.form(idempotency.new_token()))
+        other = idempotency.new_token()
+
+        # a different form after the vote: turned away, and so is any resend of it
+        for _ in range(2):
+            response = self.client.post(self.url, self.form(other, self.p2), follow=True)
+            self.assertContains(response, 'Your vote has already been recorded.')
+        self.assertFalse(idempotency.is_pending(self.student.user.pk, self.election.pk, other))
+        self.assertEqual(Vote.objects.count(), 1)
@@ -0,0 +1,154 @@
+# ---------------- turnout over time ----------------
+# One TurnoutMinute row per election per minute, counting the ballots (and the choices
+# on them) that came in during that minute. cast_ballot_view adds to it once each cast
+# has committed, so the results page can chart voting speed and we can see the peak
+# load of an election without ever grouping the vote tables by timestamp.
+#
+# backfill() rebuilds the rows from the Vote / Ballot / RankedBallot timestamps, for
+# elections that were cast before this existed. Kiosk batches are not counted: they
+# arrive all at once when uploaded, which says nothing about when students voted.
+
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+
+from .ballots import PAIR
+from .models import Ballot, RankedBallot, TurnoutMinute, Vote
+
+
+def minute_of(when):
+    return when.replace(second=0, microsecond=0)
+
+
+def record_cast(election_id, votes, when=None):
+    """
+    Adds one ballot with `votes` choices to its minute. Runs after the cast has
+    committed (transaction.on_commit), in its own tiny transaction, so it never holds
+    up the voter's row lock.
+    """
+    minute = minute_of(when or timezone.now())
+    rows = TurnoutMinute.objects.filter(election_id=election_id, minute=minute)
+
+    if rows.update(ballots=F('ballots') + 1, votes=F('votes') + votes):
+        return
+    try:
+        # first ballot of this minute
+        with transaction.atomic():
+            TurnoutMinute.objects.create(election_id=election_id, minute=minute, ballots=1, votes=votes)
+    except IntegrityError:
+        # another worker created the row between our update and our insert
+        rows.update(ballots=F('ballots') + 1, votes=F('votes') + votes)
+
+
+def series(election):
+    """
+    [(minute, ballots, votes), ...] from the first to the last minute anyone voted,
+    including the quiet minutes in between as zeros.
+    """
+    rows = list(
+        TurnoutMinute.objects.filter(election=election)
+        .order_by('minute')
+        .values_list('minute', 'ballots', 'votes')
+    )
+    if not rows:
+        return []
+
+    by_minute = {minute: (ballots, votes) for minute, ballots, votes in rows}
+    filled = []
+    minute, last = rows[0][0], rows[-1][0]
+    while minute <= last:
+        ballots, votes = by_minute.get(minute, (0, 0))
+        filled.append((minute, ballots, votes))
+        minute += timedelta(minutes=1)
+    return filled
+
+
+def _percentile(ordered, p):
+    # nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def capacity(minutes, cast_ms=50, headroom=2.0):
+    """
+    Capacity planning figures from series(): the arrival rate at the busiest minute and
+    at a few percentiles of all the minutes voting was going on, in ballots per second,
+    and how many busy workers that peak needs if a cast takes `cast_ms` milliseconds
+    (times `headroom`, since a minute's average hides the bursts inside it).
+    """
+    if not minutes:
+        return None
+
+    per_minute = sorted(ballots for _, ballots, _ in minutes)
+    busiest = max(minutes, key=lambda row: row[1])
+    peak_per_sec = busiest[1] / 60
+
+    return {
+        'ballots': sum(per_minute),
+        'minutes': len(minutes),
+        'busiest_minute': busiest[0],
+        'peak_per_minute': busiest[1],
+        'peak_per_sec': round(peak_per_sec, 2),
+        'percentiles_per_sec': {
+            p: round(_percentile(per_minute, p) / 60, 2) for p in (50, 90, 95, 99)
+        },
+        'cast_ms': cast_ms,
+        'headroom': headroom,
+        'workers_needed': max(1, math.ceil(peak_per_sec * cast_ms / 1000 * headroom)),
+    }
+
+
+def backfill(election):
+    """
+    Rebuilds an election's TurnoutMinute rows from the vote timestamps and returns how
+    many minutes were written. Votes are exact. Ballots are exact for packed storage;
+    with one Vote row per position it's the busiest single-choice position of that
+    minute, since the rows of one ballot can't be told apart (that's the point).
+    """
+    votes = defaultdict(int)
+    ballots = defaultdict(int)
+
+    def count_positions(rows):
+        for minute, method, n in rows:
+            votes[minute] += n
+            # approval positions take several ticks per ballot
+            if method != 'approval':
+                ballots[minute] = max(ballots[minute], n)
+
+    count_positions(
+        Vote.objects.filter(position__election=election)
+        .annotate(minute=TruncMinute('timestamp'))
+        .values('minute', 'position_id')
+        .annotate(n=Count('id'))
+        .values_list('minute', 'position__voting_method', 'n')
+    )
+    count_positions(
+        RankedBallot.objects.filter(position__election=election)
+        .annotate(minute=TruncMinute('timestamp'))
+        .values('minute', 'position_id')
+        .annotate(n=Count('id'))
+        .values_list('minute', 'position__voting_method', 'n')
+    )
+
+    packed = defaultdict(int)
+    for timestamp, choices in Ballot.objects.filter(election=election).values_list('timestamp', 'choices').iterator():
+        minute = minute_of(timestamp)
+        packed[minute] += 1
+        votes[minute] += len(choices) // PAIR.size
+    for minute, n in packed.items():
+        ballots[minute] = max(ballots[minute], n)
+
+    with transaction.atomic():
+        TurnoutMinute.objects.filter(election=election).delete()
+        TurnoutMinute.objects.bulk_create(
+            TurnoutMinute(election=election, minute=minute, ballots=ballots[minute], votes=votes[minute])
+            for minute in sorted(votes)
+        )
+    return len(votes)
@@ -19,7 +19,11 @@ urlpatterns = [
     
     path('ballot/<int:election_id>/', views.ballot_view, name='ballot_view'),
     
+    path('api/ballot/<int:election_id>/<str:variant>/', views.ballot_api_view, name='ballot_api'),
+
     path('cast-vote/<int:election_id>/', views.cast_ballot_view, name='cast_ballot_view'),
+
+    path('cast-vote/<int:election_id>/status/<str:token>/', views.cast_status_view, name='cast_status_view'),
     
     path('thank-you/', views.thank_you_view, name='thank_you_view'),
 
@@ -29,6 +33,22 @@ urlpatterns = [
     
     path('results/<int:election_id>/', views.election_results_view, name='election_results'),
 
+    path('results/<int:election_id>/turnout/', views.election_turnout_view, name='election_turnout'),
+
+
+    # --- OFFLINE POLLING STATIONS ---
+    path('kiosk/<int:election_id>/snapshot/<int:station_id>/', views.kiosk_snapshot_view, name='kiosk_snapshot'),
+
+    path('kiosk/<int:election_id>/upload/', views.kiosk_upload_view, name='kiosk_upload'),
+
+
+    # --- REQUEST PROFILES ---
+    path('profiles/', views.profile_list_view, name='profile_list'),
+
+    path('profiles/<int:profile_id>/', views.profile_detail_view, name='profile_detail'),
+
+    path('profiles/<int:profile_id>/stacks.folded', views.profile_stacks_view, name='profile_stacks'),
+
 ]
 
 # tthis is for serving static files during development
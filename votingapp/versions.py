@@ -0,0 +1,109 @@
+# ---------------- content versions ----------------
+# A "version" is just the time something last changed, kept in the shared cache.
+# Anything built from that data (the JSON ballot, ETags of cached pages...) puts the
+# version in its cache key / ETag, so bumping the version is all the invalidation needed.
+#
+# If the cache gets wiped the versions simply restart at "now", which is newer than
+# anything cached before, so nothing stale can be served.
+#
+#   content  -> what's on an election's ballot (positions, candidates, parties, images)
+#   tally    -> an election's results (bumped on every cast)
+#   voter    -> one student's own voting status (bumped when they cast)
+#   elections-> the list of elections and their start/end times
+#   roster   -> the student profiles (genders, sponsorship, eligibility...)
+
+import time
+
+from django.core.cache import cache
+
+from .models import Election
+from . import replica
+
+
+# changes that affect every election's ballot (parties and their logos, image variants)
+GLOBAL_KEY = 'votingapp:version:global'
+ELECTIONS_KEY = 'votingapp:version:elections'
+ROSTER_KEY = 'votingapp:version:roster'
+
+
+def _get(key):
+    return cache.get_or_set(key, time.time, None)
+
+
+def _bump(key):
+    cache.set(key, time.time(), None)
+
+
+def _content_key(election_id):
+    return f'votingapp:version:election:{election_id}'
+
+
+def _tally_key(election_id):
+    return f'votingapp:version:tally:{election_id}'
+
+
+def _voter_key(profile_id):
+    return f'votingapp:version:voter:{profile_id}'
+
+
+def bump_content(election_id=None):
+    # call when something on an election's ballot changes (None = every election)
+    _bump(GLOBAL_KEY if election_id is None else _content_key(election_id))
+
+
+def content_version(election_id):
+    # the last time anything on this election's ballot changed (unix time, float)
+    return max(_get(_content_key(election_id)), _get(GLOBAL_KEY))
+
+
+def bump_tally(election_id):
+    _bump(_tally_key(election_id))
+
+
+def tally_version(election_id):
+    return _get(_tally_key(election_id))
+
+
+def bump_voter(profile_id):
+    _bump(_voter_key(profile_id))
+
+
+def voter_version(profile_id):
+    return _get(_voter_key(profile_id))
+
+
+def bump_elections():
+    _bump(ELECTIONS_KEY)
+
+
+def elections_version():
+    return _get(ELECTIONS_KEY)
+
+
+def bump_roster():
+    _bump(ROSTER_KEY)
+
+
+def roster_version():
+    return _get(ROSTER_KEY)
+
+
+def version_tag(version):
+    # short string form for urls and etags
+    return format(int(version * 1000), 'x')
+
+
+def election_schedule():
+    """
+    [(election id, start_time, end_time), ...] for every election, cached until an
+    election is added, changed or removed. Lets pages work out which elections are
+    open right now without a query.
+    """
+    version = elections_version()
+    key = f'votingapp:schedule:{version_tag(version)}'
+    schedule = cache.get(key)
+    if schedule is None:
+        schedule = list(Election.objects.values_list('pk', 'start_time', 'end_time'))
+        if not replica.used():
+            cache.set(key, schedule, 60 * 60 * 24)
+    return schedule
@@ -1,6 +1,8 @@
 from django.shortcuts import get_object_or_404, render, redirect
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import etag
 from django.contrib.auth import authenticate, login, logout
-from django.db.models import Count
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.db import transaction
@@ -8,7 +10,19 @@ from django.utils import timezone
 from functools import wraps
 
 # importing models
-from .models import StudentProfile, Election, Position, Candidate, Vote
+from .models import StudentProfile, Election, PollingStation, RequestProfile
+from .eligibility import eligible_counts, variant_key
+from . import participation
+from . import ballots
+from . import ballot_data
+from . import versions
+from . import http_caching
+from . import tabulation
+from . import kiosk
+from . import idempotency
+from . import turnout
+from . import writer
+from .http_caching import conditional_page
 
 # this is a decorator to check if the logged in user has a profile-------
 def profile_required(view_func):
@@ -75,6 +89,7 @@ def logout_view(request):
 # ----------view for all the elections
 @login_required(login_url='login_view')
 @profile_required  
+@conditional_page(http_caching.election_list_state)
 def election_list_view(request):
     # grab the timezone aware time
     now = timezone.now()
@@ -104,6 +119,7 @@ def election_list_view(request):
 # ---------the ballot view for one specific election------------------------------
 @login_required(login_url='login_view')
 @profile_required
+@conditional_page(http_caching.ballot_state)
 def ballot_view(request, election_id): #Takes election_id of the election tha has been selected by the user in the frontend
       
     now = timezone.now()
@@ -126,6 +142,18 @@ def ballot_view(request, election_id): #Takes election_id of the election tha ha
     if election in profile.voted_in_elections.all():
         return render(request, 'already_voted.html')
 
+    # normally we only send a small shell and the browser draws the ballot from the
+    # cached json (ballot_api_view). ?render=server draws it here instead, for browsers without js
+    if request.GET.get('render') != 'server':
+        variant = variant_key(profile)
+        version = versions.content_version(election.pk)
+        context = {
+            'election': election,
+            'ballot_url': reverse('ballot_api', args=[election.pk, variant]) + f'?v={versions.version_tag(version)}',
+            'ballot_token': idempotency.new_token(),
+        }
+        return render(request, 'voting_portal.html', context)
+
     # getting all the candidates for all the positions for this particular election 
     # prefetch candidates AND their parties to avoid N+1 queries
     all_positions = election.positions.prefetch_related('candidates__party').all()
@@ -161,12 +189,105 @@ def ballot_view(request, election_id): #Takes election_id of the election tha ha
     # handing this information to the frontend
     context = {
         'election': election,
-        'positions': eligible_positions
+        'positions': eligible_positions,
+        'ballot_token': idempotency.new_token(),
     }
     return render(request, 'voting_portal.html', context)
 
 
+# ---------the ballot as json, shared by every student with the same eligibility variant------
+def _ballot_etag(request, election_id, variant):
+    # no etag for an election that isn't open, so it can't be answered with a 304 either
+    if election_id not in http_caching.open_election_ids(timezone.now()):
+        return None
+    return ballot_data.ballot_etag(election_id, variant)
+
+
+@login_required(login_url='login_view')
+@etag(_ballot_etag)
+def ballot_api_view(request, election_id, variant):
+    now = timezone.now()
+
+    # same as ballot_view: only while the election is open
+    election = get_object_or_404(
+        Election,
+        pk=election_id,
+        start_time__lte=now,
+        end_time__gte=now
+    )
+
+    try:
+        body = ballot_data.ballot_json(election, variant)
+    except ValueError:
+        raise Http404("Unknown eligibility variant.")
+
+    response = HttpResponse(body, content_type='application/json')
+
+    # the ballot is the public candidate list (nothing about the student), so browsers AND
+    # proxies may keep it. A url with the current ?v= never changes, so it can be kept for good.
+    # Without it (or with an old one) the browser has to check the etag again each time.
+    current = versions.version_tag(versions.content_version(election.pk))
+    if request.GET.get('v') == current:
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
 #-------------------casting the ballot----------------
+def _store_cast(user, election_id, post, token):
+    # the critical part of casting a ballot. Returns 'counted' or 'already_voted';
+    # raises for a closed election or an invalid ballot.
+    now = timezone.now()
+
+    # --- CRITICAL SECTION: if anything happens inside this code block, the db rolls back all changes
+    with transaction.atomic():
+        
+        # 1. get the election and check if its still active
+        election = get_object_or_404(
+            Election,
+            pk=election_id,
+            start_time__lte=now,
+            end_time__gte=now
+        )
+        
+        # 2. Lock the user's profile row so nothing else touches it till the transaction is finished
+        # (sqlite ignores this, but there the whole transaction holds the write lock from the start)
+        profile = StudentProfile.objects.select_for_update().get(user=user)
+
+        # 3. Double-check if they have voted
+        if election in profile.voted_in_elections.all():
+            # with this very form? then this is a resent copy of a ballot we counted
+            if idempotency.was_cast(user.pk, election.pk, token):
+                return 'counted'
+            return 'already_voted'
+        
+        # 4. Mark the user as having voted *in this election*
+        profile.voted_in_elections.add(election)
+        
+        # 5. get the vote data from request.post
+        # (single choices, approval ticks and rankings, see ballots.parse_submission)
+        pairs, rankings = ballots.parse_submission(post)
+                
+        # 6. --------   VOTE PROCESSING---------
+        # check if the user was a dummy and tried to submit an empty ballot
+        if not pairs and not rankings:
+            raise Exception("Empty ballot submission is not allowed.")
+
+        # store the votes (one row per position, or one packed ballot, see ballots.py)
+        ballots.record_ballot(election, pairs, rankings)
+
+        # remember the form's token with the vote, for any retries of it (see idempotency.py)
+        idempotency.record(user, election, token)
+
+        # count it in this minute's turnout once it's committed (see turnout.py)
+        choices = len(pairs) + len(rankings)
+        transaction.on_commit(lambda: turnout.record_cast(election.pk, choices), robust=True)
+
+    # --- END OF TRANSACTION ---
+    return 'counted'
+
+
 @login_required(login_url='login_view')
 @profile_required
 def cast_ballot_view(request, election_id): #Takes election_id
@@ -175,70 +296,63 @@ def cast_ballot_view(request, election_id): #Takes election_id
         # If someone tries to access this URL directly, send them back ie, we only want post requests
         return redirect('election_list_view')
 
-    now = timezone.now()
-    
-    try:
-        # --- CRITICAL SECTION: if anything happens inside this code block, the db rolls back all changes
-        with transaction.atomic():
-            
-            # 1. get the election and check if its still active
-            election = get_object_or_404(
-                Election,
-                pk=election_id,
-                start_time__lte=now,
-                end_time__gte=now
-            )
-            
-            # 2. Lock the user's profile row so nothing else touches it till the transaction is finished
-            profile = StudentProfile.objects.select_for_update().get(user=request.user)
+    # 0. the form's ballot token: a retry of a ballot we already counted (double click,
+    # browser resending the POST) gets its answer here without touching the vote tables
+    token = request.POST.get('ballot_token', '')
+    if idempotency.was_cast(request.user.pk, election_id, token):
+        return redirect('thank_you_view')
 
-            # 3. Double-check if they have voted
-            if election in profile.voted_in_elections.all():
-                messages.error(request, 'Your vote has already been recorded.')
-                return redirect('election_list_view')
-            
-            # 4. Mark the user as having voted *in this election*
-            profile.voted_in_elections.add(election)
-            
-            # 5. get the vote data from request.post
-            vote_data = {}
-            for key, value in request.POST.items():
-                # The keys for positions are their IDs (which are numbers)
-                if key.isdigit():
-                    vote_data[key] = value
-                    
-            # 6. --------   VOTE PROCESSING---------
-            votes_to_create = []
-            
-            # create the vote object for the users submission
-            for position_id, candidate_id in vote_data.items():
-                votes_to_create.append(
-                    Vote(
-                        position_id=position_id,
-                        candidate_id=candidate_id
-                    )
-                )
-                
-            # check if the user was a dummy and tried to submit an empty ballot
-            if votes_to_create:
-                # grab all the users votes for all the candidates and stamp them into the database at once
-                Vote.objects.bulk_create(votes_to_create)
-            else:
-                raise Exception("Empty ballot submission is not allowed.")
+    # the first copy of this form is still being cast: don't queue up behind it
+    if not idempotency.claim(request.user.pk, election_id, token):
+        return redirect('cast_status_view', election_id=election_id, token=token)
 
-        # --- END OF TRANSACTION ---
+    failed = True
+    
+    try:
+        # the transaction runs on the ballot writer (its own thread with the sqlite profile, see writer.py)
+        outcome = writer.run(_store_cast, request.user, election_id, request.POST, token)
+        failed = False
 
     except Election.DoesNotExist:
         messages.error(request, 'The election has just closed. Your vote was not counted.')
         return redirect('election_list_view')
+    except ValueError as e:
+        # something wrong with what was filled in: nothing was saved, let them fix it
+        messages.error(request, f'Your ballot was not counted: {e}')
+        return redirect('ballot_view', election_id=election_id)
     except Exception as e:
         messages.error(request, f'An unexpected error occurred. Please try again. {e}')
         return redirect('election_list_view')
+    finally:
+        # nothing was saved, so the same form may be sent again
+        if failed:
+            idempotency.release(request.user.pk, election_id, token)
+
+    # 3b. they had voted already (with another form). This form was never counted, so
+    # let go of it: a resend must not be told its ballot is still being saved
+    if outcome == 'already_voted':
+        idempotency.release(request.user.pk, election_id, token)
+        messages.error(request, 'Your vote has already been recorded.')
+        return redirect('election_list_view')
 
     # 7. Send the user to a "Thank You" page.
     return redirect('thank_you_view')
 
 
+@login_required(login_url='login_view')
+def cast_status_view(request, election_id, token):
+    # where a resent ballot lands while the first copy of it is still being cast
+    if idempotency.was_cast(request.user.pk, election_id, token):
+        return redirect('thank_you_view')
+
+    if idempotency.is_pending(request.user.pk, election_id, token):
+        # the page reloads itself every couple of seconds until the vote is in
+        return render(request, 'vote_pending.html', {'election_id': election_id})
+
+    # the first copy failed (it left a message saying why), nothing was counted
+    return redirect('ballot_view', election_id=election_id)
+
+
 # --- 3. After-Voting View ---
 @login_required(login_url='login_view')
 def thank_you_view(request):
@@ -251,6 +365,7 @@ def is_admin_user(user):
     return user.is_authenticated and user.is_staff
 
 @user_passes_test(is_admin_user, login_url='login_view')
+@conditional_page(http_caching.results_dashboard_state)
 def results_dashboard_view(request):
     # displays a list of all past and present elections that the user can then click on to see results
     elections = Election.objects.all().order_by('-start_time') #sorts them newest to oldest
@@ -262,6 +377,7 @@ def results_dashboard_view(request):
 
 #------------- display reuslts to admin--------------------------
 @user_passes_test(is_admin_user, login_url='login_view')
+@conditional_page(http_caching.election_results_state)
 def election_results_view(request, election_id):
     
     # get the requested election by primary key
@@ -270,15 +386,51 @@ def election_results_view(request, election_id):
     # We get all positions for this election
     positions = election.positions.all()
     
-    # We get all candidates and count how many 'votes' are related to each one.
-    candidates_with_votes = Candidate.objects.filter( 
-        position__election=election 
-    ).annotate( # this adds a new field to each candidae object in the list
-        vote_count=Count('votes')  # this says the new field will be named vote_count
-    ).order_by('position', '-vote_count') # Group by position, then vote count
+    # We get all candidates with a vote_count on each one, grouped by position then vote count.
+    # (this counts both Vote rows and packed ballots, see ballots.py)
+    candidates_with_votes = ballots.candidates_with_votes(election)
+
+    # We also get the total number of voters for this election (off the participation bitmap)
+    total_voters = participation.turnout(election)
+
+    # how many students could vote for each seat, so we can show turnout per position
+    counts = eligible_counts(election)
+    votes_per_position = {}
+    candidates_per_position = {}
+    for candidate in candidates_with_votes:
+        votes_per_position[candidate.position_id] = votes_per_position.get(candidate.position_id, 0) + candidate.vote_count
+        candidates_per_position.setdefault(candidate.position_id, []).append(candidate)
+
+    for position in positions:
+        position_candidates = candidates_per_position.get(position.pk, [])
+
+        if position.is_ranked:
+            # ranked positions are counted round by round (see tabulation.py), and the
+            # candidate list shows first preferences
+            position.result = tabulation.tabulate_position(position)
+            rounds = position.result['rounds']
+            first_round = rounds[0]['tally'] if rounds else {}
+            for candidate in position_candidates:
+                candidate.vote_count = first_round.get(candidate.pk, 0)
+                candidate.round_votes = tabulation.candidate_rounds(position.result, candidate.pk)
+            position_candidates.sort(key=lambda candidate: -candidate.vote_count)
+            position.votes_cast = position.result['ballots']
+            winner_ids = set(position.result['winners'])
+        else:
+            # plurality / approval: the top `seats` candidates with at least one vote
+            position.votes_cast = votes_per_position.get(position.pk, 0)
+            winner_ids = {candidate.pk for candidate in position_candidates[:position.seats] if candidate.vote_count}
+
+        for candidate in position_candidates:
+            candidate.is_winner = candidate.pk in winner_ids
+        position.candidate_results = position_candidates
 
-    # We also get the total number of voters for this election
-    total_voters = election.voters.count()
+        position.eligible_count = counts.get(position.pk, 0)
+        # approval ballots tick several candidates, so votes don't tell us how many people took part
+        position.turnout = (
+            round(100 * position.votes_cast / position.eligible_count, 1)
+            if position.eligible_count and position.voting_method != 'approval' else None
+        )
 
     context = {
         'election': election,
@@ -286,4 +438,118 @@ def election_results_view(request, election_id):
         'candidates_with_votes': candidates_with_votes,
         'total_voters': total_voters,
     }
-    return render(request, 'admin_election_results.html', context)
\ No newline at end of file
+    return render(request, 'admin_election_results.html', context)
+
+#------------- votes per minute, for the results page chart --------------------------
+@user_passes_test(is_admin_user, login_url='login_view')
+def election_turnout_view(request, election_id):
+    election = get_object_or_404(Election, pk=election_id)
+
+    minutes = turnout.series(election)
+    data = {
+        'election': election.name,
+        'minutes': [
+            {'minute': minute.isoformat(), 'ballots': ballot_count, 'votes': vote_count}
+            for minute, ballot_count, vote_count in minutes
+        ],
+        'capacity': turnout.capacity(minutes),
+    }
+    return JsonResponse(data)
+
+
+#------------- offline polling stations (see kiosk.py) --------------------------
+@user_passes_test(is_admin_user, login_url='login_view')
+def kiosk_snapshot_view(request, election_id, station_id):
+    # the signed file a kiosk loads before going offline: ballots + students who can still vote
+    election = get_object_or_404(Election, pk=election_id)
+    station = get_object_or_404(PollingStation, pk=station_id, is_active=True)
+
+    snapshot = kiosk.build_snapshot(election, station, request.GET.get('prefix', ''))
+
+    response = HttpResponse(snapshot, content_type='text/plain')
+    response['Content-Disposition'] = f'attachment; filename="snapshot-{election.pk}-{station.pk}.txt"'
+    return response
+
+
+@user_passes_test(is_admin_user, login_url='login_view')
+def kiosk_upload_view(request, election_id):
+    # staff upload the signed batch file a kiosk produced
+    election = get_object_or_404(Election, pk=election_id)
+
+    if request.method == 'POST':
+        station = get_object_or_404(PollingStation, pk=request.POST.get('station'), is_active=True)
+        upload = request.FILES.get('batch')
+
+        if upload is None:
+            messages.error(request, 'Please choose a batch file to upload.')
+        else:
+            try:
+                batch = kiosk.read_batch(station, upload.read().decode('ascii').strip())
+                record, created = writer.run(kiosk.ingest_batch, station, election, batch)
+            except (UnicodeDecodeError, ValueError) as e:
+                messages.error(request, f'The batch was not counted: {e}')
+            else:
+                if not created:
+                    messages.info(request, f'Batch {record.batch_id} from {station.name} was already uploaded, nothing changed.')
+                else:
+                    messages.success(
+                        request,
+                        f'Batch {record.batch_id} from {station.name}: {record.ingested} ballots counted, '
+                        f'{record.already_voted} already voted, {record.rejected} rejected.'
+                    )
+        return redirect('kiosk_upload', election_id=election.pk)
+
+    context = {
+        'election': election,
+        'stations': PollingStation.objects.filter(is_active=True).order_by('name'),
+        'batches': election.kiosk_batches.select_related('station').order_by('-received_at')[:50],
+    }
+    return render(request, 'kiosk_upload.html', context)
+
+
+#------------- request profiles (see profiling.py) --------------------------
+@user_passes_test(is_admin_user, login_url='login_view')
+def profile_list_view(request):
+    # the most recent profiles, optionally for one view only
+    profiles = RequestProfile.objects.defer('stacks', 'queries')
+    url_name = request.GET.get('view')
+    if url_name:
+        profiles = profiles.filter(url_name=url_name)
+
+    context = {
+        'profiles': profiles[:100],
+        'url_name': url_name,
+        'url_names': RequestProfile.objects.order_by('url_name').values_list('url_name', flat=True).distinct(),
+    }
+    return render(request, 'profile_list.html', context)
+
+
+@user_passes_test(is_admin_user, login_url='login_view')
+def profile_detail_view(request, profile_id):
+    profile = get_object_or_404(RequestProfile, pk=profile_id)
+
+    # the functions that were running (innermost frame) in the most samples
+    self_samples = {}
+    for line in profile.stacks.splitlines():
+        stack, _, count = line.rpartition(' ')
+        leaf = stack.rpartition(';')[2]
+        self_samples[leaf] = self_samples.get(leaf, 0) + int(count)
+    hottest = sorted(self_samples.items(), key=lambda item: -item[1])[:25]
+
+    context = {
+        'profile': profile,
+        'hottest': [
+            (frame, samples, round(100 * samples / profile.samples, 1) if profile.samples else 0)
+            for frame, samples in hottest
+        ],
+    }
+    return render(request, 'profile_detail.html', context)
+
+
+@user_passes_test(is_admin_user, login_url='login_view')
+def profile_stacks_view(request, profile_id):
+    # the collapsed stacks as a file, for flamegraph.pl or speedscope.app
+    profile = get_object_or_404(RequestProfile, pk=profile_id)
+    response = HttpResponse(profile.stacks + '\n', content_type='text/plain')
+    response['Content-Disposition'] = f'attachment; filename="profile-{profile.pk}-{profile.url_name}.folded"'
+    return response
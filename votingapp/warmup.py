@@ -0,0 +1,130 @@
+# ---------------- warming up before an election opens ----------------
+# At start_time the first wave of voters would otherwise build every cache at once:
+# ballot json for each eligibility variant, eligibility masks, image variants, the
+# participation bitmap... warm_election() builds all of that ahead of time in the
+# shared cache (run it with the warm_election command a few minutes before opening).
+#
+# Some things live inside each worker process and can't be built from outside:
+# compiled templates, the URLconf and the database connection. warm_process() does
+# those and runs in every worker as it boots when settings.WARM_WORKERS is on (see
+# gunicorn.conf.py); with CONN_MAX_AGE the connection it opens is then kept.
+
+import time
+
+from django.core.cache import cache
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver, reverse
+
+from .eligibility import all_variants, eligible_counts
+from .models import Candidate
+from . import ballot_data, ballots, images, participation, versions
+
+
+# the pages a voter goes through, plus the ballot fallback and the pages around it
+VOTER_TEMPLATES = (
+    'login.html',
+    'election_list.html',
+    'voting_portal.html',
+    'thank_you.html',
+    'already_voted.html',
+    'ineligible.html',
+    'election_inactive.html',
+)
+
+
+def _timed(steps, name, func):
+    started = time.perf_counter()
+    detail = func()
+    steps.append((name, detail, (time.perf_counter() - started) * 1000))
+
+
+def _election_images(election):
+    # every uploaded image this election's ballot shows
+    sources = set()
+    for names in Candidate.objects.filter(position__election=election).values_list(
+        'candidate_photo', 'independent_symbol', 'party__logo'
+    ):
+        sources.update(name for name in names if name)
+    return sorted(sources)
+
+
+def warm_election(election):
+    """
+    Fills the shared cache with everything the election's first voters would otherwise
+    build. Returns [(step, what was done, milliseconds)].
+    """
+    steps = []
+
+    def schedule():
+        versions.election_schedule()
+        return "election list schedule"
+
+    def eligibility():
+        counts = eligible_counts(election)
+        return f"{len(counts)} positions, {max(counts.values(), default=0)} eligible at most"
+
+    def bitmap():
+        return f"{participation.load(election).voter_count} voters so far"
+
+    def candidates():
+        # what validate_ballot looks candidates up in on every cast. After the images too:
+        # new variants bump the content version this is cached under
+        return f"{len(ballots._candidate_positions(election))} candidates"
+
+    def image_variants():
+        sources = _election_images(election)
+        results = [images.regenerate_in_worker(source, False) for source in sources]
+        images.processed_sources()
+        generated = sum(1 for _, did_generate, _ in results if did_generate)
+        failed = sum(1 for _, _, error in results if error)
+        return f"{len(sources)} images, {generated} generated, {failed} failed"
+
+    def ballot_json():
+        # after the images, so the json already points at the variants
+        variants = all_variants()
+        size = sum(len(ballot_data.ballot_json(election, variant)) for variant in variants)
+        return f"{len(variants)} variants, {size // 1024} KB"
+
+    _timed(steps, 'schedule', schedule)
+    _timed(steps, 'eligibility masks', eligibility)
+    _timed(steps, 'participation bitmap', bitmap)
+    _timed(steps, 'image variants', image_variants)
+    _timed(steps, 'candidate lookup', candidates)
+    _timed(steps, 'ballot json', ballot_json)
+    return steps
+
+
+def warm_process():
+    """
+    Loads what each worker keeps for itself: database connections, the URLconf and
+    the compiled templates. Returns [(step, what was done, milliseconds)].
+    """
+    steps = []
+
+    def databases():
+        for alias in connections:
+            connections[alias].ensure_connection()
+        return ', '.join(connections)
+
+    def urls():
+        # imports the views (and everything they import) and builds the reverse lookup
+        get_resolver().url_patterns
+        reverse('login_view')
+        return f"{len(get_resolver().reverse_dict)} url names"
+
+    def templates():
+        for name in VOTER_TEMPLATES:
+            get_template(name)
+        return f"{len(VOTER_TEMPLATES)} templates"
+
+    def shared_cache():
+        # the first cache read opens the cache backend
+        cache.get('votingapp:warmup')
+        return "cache backend"
+
+    _timed(steps, 'database connections', databases)
+    _timed(steps, 'url patterns', urls)
+    _timed(steps, 'templates', templates)
+    _timed(steps, 'cache', shared_cache)
+    return steps
@@ -0,0 +1,87 @@
+# ---------------- single writer for sqlite ----------------
+# SQLite lets one transaction write at a time. When a worker runs several threads
+# (gunicorn --threads) and they all try to cast at once, they queue up on the database
+# lock, each retrying until the busy timeout. Instead, with settings.BALLOT_WRITER_QUEUE
+# on (the 'concurrent' sqlite profile) each worker process hands its ballot writes to
+# one writer thread and waits for the result, so at most one transaction per process
+# competes for the lock and the request threads stay free for reads, which WAL never blocks.
+#
+# With any other database (or the queue turned off) run() just calls the function.
+
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class WriterQueue:
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._work, name='ballot-writer', daemon=True)
+        self.thread.start()
+
+    def _work(self):
+        while True:
+            future, func, args, kwargs = self.jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                # the same connection handling a request would get when it finishes
+                close_old_connections()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self.jobs.put((future, func, args, kwargs))
+        return future
+
+
+_lock = threading.Lock()
+_writer = None
+_writer_pid = None
+
+# set by inline() for the current thread
+_local = threading.local()
+
+
+def _get_writer():
+    global _writer, _writer_pid
+    # a forked worker doesn't inherit the parent's thread, so start one per process
+    if _writer is None or _writer_pid != os.getpid():
+        with _lock:
+            if _writer is None or _writer_pid != os.getpid():
+                _writer = WriterQueue()
+                _writer_pid = os.getpid()
+    return _writer
+
+
+def run(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) on this process's writer thread and returns its result
+    (or raises its exception), or just calls it when the writer queue is off.
+    """
+    if not getattr(settings, 'BALLOT_WRITER_QUEUE', False):
+        return func(*args, **kwargs)
+    if threading.current_thread().name == 'ballot-writer' or getattr(_local, 'inline', False):
+        # already on the writer (a write calling another write), or asked to stay on this thread
+        return func(*args, **kwargs)
+    return _get_writer().submit(func, *args, **kwargs).result()
+
+
+@contextmanager
+def inline():
+    # writes inside this block run on the calling thread, e.g. so a profiled request
+    # (see profiling.py) sees its own cast. The busy timeout still keeps them safe.
+    previous = getattr(_local, 'inline', False)
+    _local.inline = True
+    try:
+        yield
+    finally:
+        _local.inline = previous